@@ -0,0 +1,91 @@
+import logging
+import os
+from itertools import islice
+
+from starlette.concurrency import run_in_threadpool
+
+from instrumentation import log_event
+
+logger = logging.getLogger(__name__)
+
+# Async access goes through Motor when MONGODB_URI is set. Without it (the
+# default) every query runs on the synchronous pymongo collection in a thread
+# of the server's pool, so each in-flight request still holds one thread and
+# concurrency is capped by that pool as before the async endpoints
+MONGODB_URI = os.getenv("MONGODB_URI")
+
+_fallback_logged = False
+
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+}
+
+# Server-side limit for every query, raised as pymongo ExecutionTimeout
+QUERY_TIMEOUT_MS = int(os.getenv("MONGO_QUERY_TIMEOUT_MS", "30000"))
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _client = AsyncIOMotorClient(MONGODB_URI, **POOL_OPTIONS)
+    return _client
+
+
+def async_collection(collection):
+    # The same database/collection as a synchronous one, on the async client
+    global _fallback_logged
+    if MONGODB_URI is None:
+        if not _fallback_logged:
+            _fallback_logged = True
+            log_event(logger, logging.WARNING, "async_db_fallback", reason="MONGODB_URI unset", mode="pymongo in threadpool")
+        return None
+    return get_client()[collection.database.name][collection.name]
+
+
+async def find_all(collection, query, projection, batch_size=1000):
+    motor_collection = async_collection(collection)
+    if motor_collection is None:
+        return await run_in_threadpool(
+            lambda: list(collection.find(query, projection, batch_size=batch_size).max_time_ms(QUERY_TIMEOUT_MS))
+        )
+    cursor = motor_collection.find(query, projection, batch_size=batch_size).max_time_ms(QUERY_TIMEOUT_MS)
+    return await cursor.to_list(length=None)
+
+
+async def iter_batches(collection, query, projection, batch_size=1000):
+    # Yields the results a batch at a time, so callers never hold the whole result set
+    motor_collection = async_collection(collection)
+    if motor_collection is None:
+        cursor = collection.find(query, projection, batch_size=batch_size).max_time_ms(QUERY_TIMEOUT_MS)
+        while True:
+            batch = await run_in_threadpool(lambda: list(islice(cursor, batch_size)))
+            if not batch:
+                return
+            yield batch
+    cursor = motor_collection.find(query, projection, batch_size=batch_size).max_time_ms(QUERY_TIMEOUT_MS)
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+async def aggregate_all(collection, pipeline, batch_size=1000):
+    options = {"allowDiskUse": True, "batchSize": batch_size, "maxTimeMS": QUERY_TIMEOUT_MS}
+    motor_collection = async_collection(collection)
+    if motor_collection is None:
+        return await run_in_threadpool(lambda: list(collection.aggregate(pipeline, **options)))
+    return await motor_collection.aggregate(pipeline, **options).to_list(length=None)
+
+
+def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
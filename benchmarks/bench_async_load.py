@@ -0,0 +1,118 @@
+"""Load test of simultaneous /voltage-data requests, Motor against worker threads.
+
+Each mode runs in a fresh process against the same synthetic readings:
+
+    python benchmarks/bench_async_load.py --mongo-uri mongodb://localhost:27017 --concurrency 200
+
+"threads" leaves MONGODB_URI unset, the shipped default: async_db then runs
+every pymongo query in a thread of the server's pool (40 threads in anyio), as
+the synchronous endpoints did, so requests beyond that queue for a thread.
+"motor" sets it so the queries are awaited on the event loop over the Motor
+connection pool. Without --mongo-uri only the threads mode runs, on mongomock,
+which shows the fallback's queueing but not a database's latency; the gain of
+the async layer can only be measured with --mongo-uri. The response cache is
+disabled so every request reaches the database.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), HERE]
+
+
+def load(args, generated):
+    from suite import bind_database, connect, generate
+
+    client = connect(args.mongo_uri)
+    config, co = bind_database(client, args.database)
+    start = datetime.fromisoformat(args.start)
+    if not generated:
+        generate(config, co, args.meters, start, args.days, args.interval, seed=0)
+    return start
+
+
+async def drive(app, args, start):
+    import httpx
+
+    end = start + timedelta(days=1) - timedelta(seconds=args.interval)
+    params = {"start_time": start.isoformat(), "end_time": end.isoformat(), "type": "forecast-voltage-data", "time_period": "day"}
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await http.get("/voltage-data", params={**params, "meter_ID": i % args.meters + 1})
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        await one(0)  # warm up connections and imports
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def _measure(mode, args, generated, queue):
+    os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+    os.environ["MONGO_MAX_POOL_SIZE"] = str(args.pool_size)
+    if mode == "motor":
+        os.environ["MONGODB_URI"] = args.mongo_uri
+    start = load(args, generated)
+
+    from fastapi import FastAPI
+    import router
+
+    app = FastAPI()
+    app.include_router(router.TestRouter)
+
+    async def measure():
+        from anyio import to_thread
+        threads = to_thread.current_default_thread_limiter().total_tokens
+        return (*await drive(app, args, start), threads)
+
+    queue.put(asyncio.run(measure()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=None, help="local MongoDB; required for the motor mode")
+    parser.add_argument("--database", default="prediction_bench")
+    parser.add_argument("--meters", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings")
+    parser.add_argument("--start", default="2024-10-01T00:00:00")
+    parser.add_argument("--concurrency", type=int, default=200, help="simultaneous requests")
+    parser.add_argument("--pool-size", type=int, default=100, help="Motor maxPoolSize")
+    args = parser.parse_args()
+
+    modes = ["threads", "motor"] if args.mongo_uri else ["threads"]
+    if args.mongo_uri:
+        # Load the readings once; both modes read the same database
+        load(args, generated=False)
+
+    context = multiprocessing.get_context("spawn")
+    for mode in modes:
+        queue = context.Queue()
+        process = context.Process(target=_measure, args=(mode, args, bool(args.mongo_uri), queue))
+        process.start()
+        latencies, errors, elapsed, threads = queue.get()
+        process.join()
+        label = "motor (event loop)" if mode == "motor" else f"threads (pymongo, {threads} threads)"
+        print(f"{label:<28} {args.concurrency} requests in {elapsed:6.2f}s  {args.concurrency / elapsed:8.1f} req/s  "
+              f"p50 {np.percentile(latencies, 50):8.1f} ms  p95 {np.percentile(latencies, 95):8.1f} ms  "
+              f"p99 {np.percentile(latencies, 99):8.1f} ms  errors {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare the dict/DataFrame forecast input path with the columnar reader.
+
+Each path runs in a fresh process over a synthetic cursor of per-minute
+readings and reports rows/sec and the peak RSS growth of that process. The
+streaming path feeds the cursor batch by batch into the bucket aggregates, so
+its peak should stay flat as rows grow:
+
+    python benchmarks/bench_columnar.py --rows 200000 500000
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_cursor(rows):
+    # Yields documents one at a time like a pymongo cursor does
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        yield {"meter": 1, "createdAt": start + timedelta(minutes=i), "data": {"value": 10.0 + (i % 60) / 6}}
+
+
+def cursor_only(rows):
+    # Baseline: the cost of producing the documents, shared by both paths
+    return sum(1 for _ in synthetic_cursor(rows))
+
+
+def legacy_path(rows):
+    import pandas as pd
+
+    data = list(synthetic_cursor(rows))
+    df = pd.DataFrame(data)
+    df['ds'] = pd.to_datetime(df['createdAt'])
+    df['y'] = df['data'].apply(lambda x: x['value'])
+    df.set_index('ds', inplace=True)
+    return len(df.resample('30min').ffill()['y'])
+
+
+def columnar_path(rows, dtype="float64"):
+    from columnar import read_columns, to_series
+
+    columns = read_columns(synthetic_cursor(rows), dtype=dtype)
+    return len(to_series(columns).resample('30min').ffill())
+
+
+def streaming_path(rows):
+    from itertools import islice
+
+    from resampler import StreamingResampler
+
+    start = datetime(2024, 1, 1)
+    resampler = StreamingResampler(start, start + timedelta(minutes=rows), '30min')
+    cursor = synthetic_cursor(rows)
+    while True:
+        batch = list(islice(cursor, 1000))
+        if not batch:
+            break
+        resampler.add_documents(batch)
+    return len(resampler.series("asof"))
+
+
+def _measure(path, rows, queue):
+    # Import the libraries first so the RSS growth reflects the data only
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import columnar  # noqa: F401
+    import resampler  # noqa: F401
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    PATHS[path](rows)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak - baseline) / 1024))
+
+
+PATHS = {
+    "cursor-only": cursor_only,
+    "legacy": legacy_path,
+    "columnar": columnar_path,
+    "columnar-f32": lambda rows: columnar_path(rows, "float32"),
+    "streaming": streaming_path,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 500000])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for rows in args.rows:
+        for path in PATHS:
+            queue = context.Queue()
+            process = context.Process(target=_measure, args=(path, rows, queue))
+            process.start()
+            elapsed, peak_mb = queue.get()
+            process.join()
+            print(f"{rows:>9} rows  {path:<13} {rows / elapsed:>12,.0f} rows/s  peak RSS +{peak_mb:>8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare the per-point find_one/insert_one loop with the bulk upsert path.
+
+Runs against mongomock by default, or a real server with --mongo-uri. The
+round-trip count is the number to compare; mongomock's bulk upserts scan the
+collection per operation, so its timings are not representative.
+
+    python benchmarks/bench_prediction_writes.py --points 1440 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction_store import PredictionWriter
+
+
+class CountingCollection:
+    """Forwards to a collection and counts calls that reach the server."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+def make_forecast(meter, object_id, points, start):
+    return [
+        {
+            "id": object_id,
+            "meter": meter,
+            "data": {
+                "value": 10.0,
+                "createdAt": (start + timedelta(minutes=i)).isoformat(),
+                "yhat": 10.0 + i / points,
+                "ds": (start + timedelta(minutes=i)).isoformat(),
+            },
+        }
+        for i in range(points)
+    ]
+
+
+def legacy_write(collection, meter, forecasts):
+    for forecast in forecasts:
+        if not collection.find_one({"meter": meter, "data.createdAt": forecast['data']['createdAt']}):
+            collection.insert_one(dict(forecast))
+
+
+def get_collection(uri, name):
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)["prediction_bench"][name]
+    import mongomock
+    return mongomock.MongoClient()["prediction_bench"][name]
+
+
+def run(label, collection, write, forecasts, repeat):
+    counted = CountingCollection(collection)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        write(counted, forecasts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} round trips/request: {counted.round_trips / repeat:>7.0f}   "
+          f"time/request: {elapsed / repeat * 1000:>9.1f} ms   documents: {collection.count_documents({})}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=1440)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mongo-uri", default=None)
+    args = parser.parse_args()
+
+    forecasts = make_forecast(1, "66f0efcdf65db44ec9603972", args.points, datetime(2024, 10, 1))
+
+    legacy = get_collection(args.mongo_uri, "legacy")
+    legacy.drop()
+    run("legacy", legacy, lambda c, f: legacy_write(c, 1, f), forecasts, args.repeat)
+
+    bulk = get_collection(args.mongo_uri, "bulk")
+    bulk.drop()
+    writers = {}
+    run("bulk", bulk, lambda c, f: writers.setdefault(id(c), PredictionWriter(c)).write(f), forecasts, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Worker startup cost: router import time and time to the first responses.
+
+Each mode runs in a fresh interpreter, as a newly started uvicorn worker
+would, against a small synthetic mongomock (or --mongo-uri) database:
+
+    python benchmarks/bench_startup.py --workers 2 --engine sarimax
+
+"cold" leaves FORECAST_PREWARM unset, so the first forecast imports
+statsmodels in the server and in a pool worker; "prewarm" sets it, which
+moves that work into application startup through ``warmup.lifespan``.
+Reported per mode: the import time of the routers, the lifespan startup
+time, and the latency of the first raw data request and of the first and
+second forecast.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), HERE]
+
+
+async def child(args):
+    from suite import bind_database, connect, generate
+
+    client = connect(args.mongo_uri)
+    config, co = bind_database(client, args.database)
+    start = datetime.fromisoformat(args.start)
+    generate(config, co, 2, start, 1, args.interval, seed=0)
+
+    started = time.perf_counter()
+    import router
+    import test
+    import warmup
+    import_s = time.perf_counter() - started
+    loaded = sorted(name for name in ("pandas", "scipy", "statsmodels") if name in sys.modules)
+
+    import httpx
+    from fastapi import FastAPI
+
+    app = FastAPI(lifespan=warmup.lifespan)
+    app.include_router(router.TestRouter)
+    app.include_router(test.TRouter)
+
+    end = start + timedelta(days=1) - timedelta(seconds=args.interval)
+    raw = {"start_time": start.isoformat(), "end_time": end.isoformat(), "meter_ID": 1, "type": "x", "time_period": "day"}
+    forecast = {
+        "type": "forecast-voltage-data", "meterID": 1, "startDate": start.isoformat(), "endDate": end.isoformat(),
+        "timePeriod": args.period, "engine": args.engine,
+    }
+    result = {"import_s": import_s, "loaded_at_import": loaded}
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        result["startup_s"] = time.perf_counter() - started
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for name, path, params in (
+                ("first_raw_s", "/voltage-data", raw),
+                ("first_forecast_s", "/forecast", forecast),
+                ("second_forecast_s", "/forecast", {**forecast, "meterID": 2}),
+            ):
+                started = time.perf_counter()
+                response = await http.get(path, params=params)
+                result[name] = time.perf_counter() - started
+                result[name.replace("_s", "_status")] = response.status_code
+    from forecast_pool import forecast_pool
+    forecast_pool.shutdown()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument("--database", default="prediction_bench")
+    parser.add_argument("--start", default="2024-01-01T00:00:00")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between readings")
+    parser.add_argument("--engine", default="sarimax")
+    parser.add_argument("--period", default="week")
+    parser.add_argument("--workers", type=int, default=2, help="Forecast pool processes (0 fits in the server process)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    base = [sys.executable, os.path.abspath(__file__), "--child", "--database", args.database, "--start", args.start,
+            "--interval", str(args.interval), "--engine", args.engine, "--period", args.period]
+    if args.mongo_uri:
+        base += ["--mongo-uri", args.mongo_uri]
+    for mode in ("cold", "prewarm"):
+        env = {**os.environ, "FORECAST_POOL_WORKERS": str(args.workers), "FORECAST_PREWARM": "1" if mode == "prewarm" else "0",
+               "RESPONSE_CACHE_MAX_ENTRIES": "0"}
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            output = subprocess.run(base, env=env, capture_output=True, text=True, check=True).stdout
+            wall = time.perf_counter() - started
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:<8} import {r['import_s']:.2f}s (loaded {','.join(r['loaded_at_import'])})  startup {r['startup_s']:.2f}s  "
+                  f"first raw {r['first_raw_s']:.2f}s  first forecast {r['first_forecast_s']:.2f}s [{r['first_forecast_status']}]  "
+                  f"second forecast {r['second_forecast_s']:.2f}s  process {wall:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
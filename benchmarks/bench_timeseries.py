@@ -0,0 +1,104 @@
+"""Compare /forecasting reads from the nested readings with the time-series copy.
+
+Generates nested readings, migrates them with timeseries.ReadingsMigration
+and runs the same per-meter, per-metric window query against both layouts:
+
+    python benchmarks/bench_timeseries.py --mongo-uri mongodb://localhost:27017 --meters 5 --days 7
+
+Reports the migration rate and, per layout, the median query time and the
+documents and bytes the server examined (from explain executionStats and
+the collection's average document size; time-series documents are
+buckets). Time-series collections need MongoDB 5.0 or newer.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), HERE]
+
+
+def avg_object_size(db, name):
+    return db.command("collStats", name).get("avgObjSize", 0)
+
+
+def explain(collection, query, projection):
+    # Finds on a time-series collection run as an aggregation, with the stats under its $cursor stage
+    explained = collection.find(query, projection).explain()
+    stats = explained.get("executionStats")
+    for stage in explained.get("stages", []):
+        stats = stats or stage.get("$cursor", {}).get("executionStats")
+    return stats["totalDocsExamined"], stats["totalKeysExamined"]
+
+
+def measure(collection, query, projection, value_path, repeat):
+    from columnar import read_columns
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = read_columns(collection.find(query, projection), value_path=value_path).timestamps.size
+        timings.append((time.perf_counter() - started) * 1000)
+    return rows, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", required=True)
+    parser.add_argument("--database", default="prediction_bench")
+    parser.add_argument("--meters", type=int, default=5)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between readings")
+    parser.add_argument("--start", default="2024-01-01T00:00:00")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from suite import OBJECT_IDS, bind_database, connect, generate
+
+    client = connect(args.mongo_uri)
+    config, co = bind_database(client, args.database)
+    start = datetime.fromisoformat(args.start)
+    rows = generate(config, co, args.meters, start, args.days, args.interval, seed=0)
+
+    import test
+    from timeseries import ReadingsMigration, timeseries_query
+
+    db = co.collection.database
+    target = db["READINGS_TS"]
+    target.drop()
+    db["MIGRATIONS"].drop()
+    migration = ReadingsMigration(co.collection, target, db["MIGRATIONS"], batch_size=args.batch_size, settle=0)
+    started = time.perf_counter()
+    state = migration.run()
+    elapsed = time.perf_counter() - started
+    print(f"Migrated {state['documents']} documents into {state['measurements']} measurements "
+          f"in {elapsed:.1f}s ({state['documents'] / elapsed:,.0f} documents/s)")
+
+    end = start + timedelta(days=args.days)
+    layouts = {
+        "nested": (co.collection, co.collection.name, lambda meter, metric: test.forecasting_query(start, end, meter, metric), lambda metric: ("data", metric, "value")),
+        "timeseries": (target, f"system.buckets.{target.name}", lambda meter, metric: timeseries_query(start, end, meter, metric), lambda metric: ("value",)),
+    }
+    for layout, (collection, stats_name, build, value_path) in layouts.items():
+        object_size = avg_object_size(db, stats_name)
+        times, docs, keys, total_rows = [], 0, 0, 0
+        for meter in range(1, args.meters + 1):
+            for metric in OBJECT_IDS.values():
+                query, projection = build(meter, metric)
+                found, median_ms = measure(collection, query, projection, value_path(metric), args.repeat)
+                examined, keys_examined = explain(collection, query, projection)
+                times.append(median_ms)
+                docs += examined
+                keys += keys_examined
+                total_rows += found
+        print(f"{layout:<11} {total_rows:>9} rows  median {statistics.median(times):>8.1f} ms/query  "
+              f"docs examined {docs:>9}  keys examined {keys:>9}  ~{docs * object_size / 1024 / 1024:>8.1f} MB scanned")
+    print(f"{rows} readings generated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Reproducible endpoint benchmark on synthetic meter readings.
+
+Generates readings for every meter at a fixed density, loads them into
+mongomock (default) or a local MongoDB, binds that database in place of the
+project's Database.config and rdb.co modules, and drives the raw data and
+forecast endpoints through the ASGI app:
+
+    python benchmarks/suite.py --meters 5 --days 7 --interval 60 \\
+        --requests 50 --concurrency 8 --output results.json
+    python benchmarks/suite.py ... --compare previous.json
+
+Per endpoint and time period it reports p50/p95/p99 latency, throughput at
+the given concurrency and the peak Python allocation of a single request.
+mongomock has no indexes and scans on every upsert, so use --mongo-uri for
+representative /forecasting (prediction write) numbers.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+OBJECT_IDS = {
+    "forecast-kilowatt-data": "66f0efcdf65db44ec9603972",
+    "forecast-current-data": "66f0f06ef65db44ec960398a",
+    "forecast-voltage-data": "66f0f039f65db44ec9603982",
+}
+
+RAW_ENDPOINTS = {
+    "/current-data": "forecast-current-data",
+    "/voltage-data": "forecast-voltage-data",
+    "/kilowatt-data": "forecast-kilowatt-data",
+}
+
+
+def connect(uri):
+    if uri:
+        from pymongo import MongoClient
+        return MongoClient(uri)
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def bind_database(client, name):
+    # The routers import their collections from these modules at import time
+    db = client[name]
+    config = types.ModuleType("Database.config")
+    config.db = db
+    config.current_collection = db["CURRENT_AVG"]
+    config.voltage_collection = db["VOLTAGE_AVG"]
+    config.kilowatt_collection = db["KILOWATT_AVG"]
+    co = types.ModuleType("rdb.co")
+    co.collection = db["READINGS"]
+    co.prediction_collection = db["PREDICTIONS"]
+    for package, module in (("Database", config), ("rdb", co)):
+        sys.modules[package] = types.ModuleType(package)
+        sys.modules[module.__name__] = module
+        setattr(sys.modules[package], module.__name__.split(".")[1], module)
+    bind_schemas()
+    return config, co
+
+
+def bind_schemas():
+    # test.py validates /forecasting responses with the app's demo.schemas, which is
+    # not part of this repository; a matching stand-in is used when it is missing
+    if importlib.util.find_spec("demo") is not None:
+        return
+    from pydantic import BaseModel
+
+    class PointData(BaseModel):
+        value: float
+        createdAt: str
+        yhat: float
+        ds: str
+
+    class ForecastData(BaseModel):
+        id: str
+        meter: int
+        data: PointData
+
+    schemas = types.ModuleType("demo.schemas")
+    schemas.BaseModel = BaseModel
+    schemas.PointData = PointData
+    schemas.ForecastData = ForecastData
+    sys.modules["demo"] = types.ModuleType("demo")
+    sys.modules["demo"].schemas = schemas
+    sys.modules["demo.schemas"] = schemas
+
+
+def generate(config, co, meters, start, days, interval, seed, batch=10000):
+    rng = np.random.default_rng(seed)
+    steps = int(days * 86400 // interval)
+    offsets = np.arange(steps) * interval
+    daily = np.sin(2 * np.pi * offsets / 86400)
+    collections = (config.current_collection, config.voltage_collection, config.kilowatt_collection)
+    for collection in (*collections, co.collection, co.prediction_collection):
+        collection.drop()
+    for meter in range(1, meters + 1):
+        series = [base + scale * daily + rng.normal(0, scale / 10, steps) for base, scale in ((10, 3), (230, 5), (2, 1))]
+        for begin in range(0, steps, batch):
+            times = [start + timedelta(seconds=int(s)) for s in offsets[begin:begin + batch]]
+            for collection, values in zip(collections, series):
+                collection.insert_many([
+                    {"meter": meter, "createdAt": t, "data": {"value": float(v)}}
+                    for t, v in zip(times, values[begin:begin + batch])
+                ])
+            co.collection.insert_many([
+                {
+                    "meter": meter,
+                    "createdAt": t,
+                    "data": {object_id: {"value": float(values[begin + i])} for object_id, values in zip(OBJECT_IDS.values(), series[::-1])},
+                }
+                for i, t in enumerate(times)
+            ])
+    for collection in (*collections, co.collection):
+        collection.create_index([("meter", 1), ("createdAt", 1)])
+    return steps * meters
+
+
+def scenarios(args, start):
+    end = start + timedelta(days=min(args.days, 1)) - timedelta(seconds=args.interval)
+    window = {"start_time": start.isoformat(), "end_time": end.isoformat()}
+    forecast_window = {"startDate": start.isoformat(), "endDate": end.isoformat()}
+    for period in args.periods:
+        for path, type in RAW_ENDPOINTS.items():
+            yield path, period, lambda meter, p=path, t=type, tp=period: (p, {**window, "meter_ID": meter, "type": t, "time_period": tp})
+        for path in ("/forecast", "/forecasting"):
+            if path in args.skip:
+                continue
+            yield path, period, lambda meter, p=path, tp=period: (p, {
+                **forecast_window, "meterID": meter, "type": "forecast-current-data", "timePeriod": tp, "engine": args.engine,
+            })
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+async def run_scenario(client, build, args):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        nonlocal errors
+        path, params = build(i % args.meters + 1)
+        async with semaphore:
+            if args.cold:
+                import model_cache
+                import response_cache
+                model_cache.forecast_cache.clear()
+                response_cache.response_cache.clear()
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+async def peak_allocation(client, build):
+    path, params = build(1)
+    tracemalloc.start()
+    await client.get(path, params=params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+async def run(args):
+    import httpx
+    from fastapi import FastAPI
+
+    client = connect(args.mongo_uri)
+    config, co = bind_database(client, args.database)
+    start = datetime.fromisoformat(args.start)
+    load_started = time.perf_counter()
+    rows = generate(config, co, args.meters, start, args.days, args.interval, args.seed)
+    print(f"Loaded {rows} readings per collection in {time.perf_counter() - load_started:.1f}s")
+
+    import router
+    import test
+
+    app = FastAPI()
+    app.include_router(router.TestRouter)
+    app.include_router(test.TRouter)
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        for path, period, build in scenarios(args, start):
+            latencies, errors, elapsed = await run_scenario(http, build, args)
+            result = {
+                "endpoint": path,
+                "time_period": period,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "errors": errors,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "mean_ms": float(np.mean(latencies)),
+                "throughput_rps": args.requests / elapsed,
+                "peak_alloc_mb": await peak_allocation(http, build) if args.memory else None,
+            }
+            results.append(result)
+            print(f"{path:<15} {period:<6} p50 {result['p50_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms  "
+                  f"p99 {result['p99_ms']:>9.1f} ms  {result['throughput_rps']:>8.1f} req/s  errors {errors}"
+                  + (f"  peak {result['peak_alloc_mb']:.1f} MB" if args.memory else ""))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "commit": commit}
+
+
+def compare(results, path):
+    with open(path) as f:
+        previous = {(r["endpoint"], r["time_period"]): r for r in json.load(f)["results"]}
+    print(f"\nChange against {path} (negative is faster):")
+    for result in results:
+        old = previous.get((result["endpoint"], result["time_period"]))
+        if old is None:
+            continue
+        deltas = [
+            f"{key} {100 * (result[key] - old[key]) / old[key]:+6.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+            if old.get(key)
+        ]
+        print(f"{result['endpoint']:<15} {result['time_period']:<6} " + "  ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default=None, help="local MongoDB to use instead of mongomock")
+    parser.add_argument("--database", default="prediction_bench")
+    parser.add_argument("--meters", type=int, default=3)
+    parser.add_argument("--days", type=float, default=2)
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings")
+    parser.add_argument("--start", default="2024-10-01T00:00:00")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--periods", nargs="+", default=["day", "week", "month"])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--engine", default=None, help="forecast engine to request")
+    parser.add_argument("--cold", action="store_true", help="clear the model and response caches before every request")
+    parser.add_argument("--skip", nargs="*", default=[], help="endpoints to leave out, e.g. /forecasting")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced allocation pass")
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    parser.add_argument("--compare", default=None, help="previous JSON results to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": environment(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
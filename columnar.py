@@ -0,0 +1,129 @@
+import json
+import os
+from itertools import islice
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # plain json is used for columnar responses without it
+    orjson = None
+
+# dtype used for reading values; float32 halves memory for long series
+COLUMN_DTYPE = np.dtype(os.getenv("FORECAST_VALUE_DTYPE", "float64"))
+
+CHUNK_SIZE = int(os.getenv("COLUMN_CHUNK_SIZE", "4096"))
+
+
+class Columns(NamedTuple):
+    timestamps: np.ndarray
+    values: np.ndarray
+    meters: Optional[np.ndarray] = None
+
+
+def _value_getter(path):
+    def get(doc):
+        for key in path:
+            doc = doc.get(key) if doc is not None else None
+        return doc
+
+    if len(path) == 2:
+        first, second = path
+        # Common case ("data", "value"): avoid the generic loop per document
+        def get(doc):
+            nested = doc.get(first)
+            return nested.get(second) if nested is not None else None
+    return get
+
+
+def read_columns(cursor, value_path=("data", "value"), dtype=COLUMN_DTYPE, with_meter=False, chunk_size=CHUNK_SIZE):
+    """Decode a cursor of readings into contiguous timestamp/value arrays.
+
+    Documents are consumed in chunks, so at most ``chunk_size`` decoded
+    documents are alive at a time besides the output arrays. Missing values
+    become NaN. The result is sorted by timestamp.
+    """
+    get_value = _value_getter(value_path)
+    ts_chunks, value_chunks, meter_chunks = [], [], []
+    documents = iter(cursor)
+    while True:
+        chunk = list(islice(documents, chunk_size))
+        if not chunk and ts_chunks:
+            break
+        # DatetimeIndex parses datetime objects far faster than np.array(..., "datetime64")
+        times = pd.DatetimeIndex([doc["createdAt"] for doc in chunk])
+        ts_chunks.append(times.values.astype("datetime64[ms]"))
+        value_chunks.append(np.array([get_value(doc) for doc in chunk], dtype=dtype))
+        if with_meter:
+            meter_chunks.append(np.array([doc["meter"] for doc in chunk], dtype=np.int64))
+        if len(chunk) < chunk_size:
+            break
+
+    timestamps = np.concatenate(ts_chunks)
+    values = np.concatenate(value_chunks)
+    meters = np.concatenate(meter_chunks) if with_meter else None
+
+    if len(timestamps) > 1 and (np.diff(timestamps) < np.timedelta64(0, "ms")).any():
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+        meters = meters[order] if meters is not None else None
+    return Columns(timestamps, values, meters)
+
+
+def split_by_meter(columns, meters):
+    # Per-meter views of a multi-meter read, in timestamp order
+    result = {}
+    for meter in meters:
+        mask = columns.meters == meter
+        result[meter] = Columns(columns.timestamps[mask], columns.values[mask])
+    return result
+
+
+def to_series(columns, name="y"):
+    return pd.Series(columns.values, index=pd.DatetimeIndex(columns.timestamps), name=name)
+
+
+def thin_columns(columns, gap):
+    # Keeps the first reading and then each reading at least ``gap`` after the
+    # last kept one, like iter_time_gap, jumping between kept points by bisection
+    timestamps = columns.timestamps
+    step = np.timedelta64(int(gap.total_seconds() * 1000), "ms")
+    keep = []
+    i = 0
+    while i < timestamps.size:
+        keep.append(i)
+        i = np.searchsorted(timestamps, timestamps[i] + step, side="left")
+    keep = np.asarray(keep, dtype=np.intp)
+    meters = columns.meters[keep] if columns.meters is not None else None
+    return Columns(timestamps[keep], columns.values[keep], meters)
+
+
+def epoch_ms(timestamps):
+    return np.asarray(timestamps).astype("datetime64[ms]").astype(np.int64)
+
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "f":
+            return np.where(np.isnan(value), None, value).tolist()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(payload):
+    # NumPy arrays are serialized directly; NaN becomes null
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
+
+
+class ColumnarResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
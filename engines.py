@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+from fastapi import HTTPException
+
+from model_cache import fit_sarimax
+
+# Fitted models returned by an engine implement ``forecast(steps)`` returning
+# an array of values, and ``extend(values)`` returning a model updated with new
+# observations using the parameters that are already estimated.
+
+
+# Longer seasons make the SARIMAX state too large to fit per request (a
+# 96-step season takes minutes); 48 is the longest generate_forecast_sarima used
+MAX_SARIMAX_SEASON = int(os.getenv("SARIMAX_MAX_SEASON", "48"))
+
+
+def seasonal_order_for(n, period, seasonal=(1, 1, 1)):
+    # A daily season of the resampled series when there are two of them to
+    # estimate it from and it is short enough to fit, otherwise none
+    if period > MAX_SARIMAX_SEASON or n < 2 * period:
+        return (0, 0, 0, 0)
+    return (*seasonal, period)
+
+
+class SarimaxEngine:
+    name = "sarimax"
+
+    def __init__(self, order=(1, 1, 1), seasonal_order=None, start_params=None):
+        self.order = order
+        # None derives the season from the resample period, see seasonal_order_for
+        self.seasonal_order = seasonal_order
+        # Parameters of an earlier fit of the same order to start the optimizer from
+        self.start_params = start_params
+
+    def fit(self, values, period):
+        # model_orders may have tuned a full specification for the series
+        seasonal_order = self.seasonal_order or seasonal_order_for(len(values), period)
+        return fit_sarimax(values, self.order, seasonal_order, self.start_params)
+
+
+class SeasonalNaive:
+    def __init__(self, history, period):
+        self.history = history[-period:]
+        self.period = period
+
+    def forecast(self, steps):
+        if len(self.history) < self.period:
+            return np.full(steps, self.history[-1])
+        return np.resize(self.history, steps)
+
+    def extend(self, values):
+        return SeasonalNaive(np.concatenate([self.history, values]), self.period)
+
+
+class SeasonalNaiveEngine:
+    name = "seasonal-naive"
+
+    def fit(self, values, period):
+        return SeasonalNaive(np.asarray(values, dtype=float), period)
+
+
+class HoltWinters:
+    """Additive Holt-Winters state with a damped trend."""
+
+    def __init__(self, level, trend, season, position, alpha, beta, gamma, phi):
+        self.level = level
+        self.trend = trend
+        self.season = season
+        self.position = position
+        self.alpha, self.beta, self.gamma, self.phi = alpha, beta, gamma, phi
+
+    def extend(self, values):
+        level, trend, season = self.level, self.trend, self.season.copy()
+        position, m = self.position, len(self.season)
+        alpha, beta, gamma, phi = self.alpha, self.beta, self.gamma, self.phi
+        for y in np.asarray(values, dtype=float):
+            s = season[position % m] if m else 0.0
+            previous = level
+            level = alpha * (y - s) + (1 - alpha) * (previous + phi * trend)
+            trend = beta * (level - previous) + (1 - beta) * phi * trend
+            if m:
+                season[position % m] = gamma * (y - level) + (1 - gamma) * s
+            position += 1
+        return HoltWinters(level, trend, season, position, alpha, beta, gamma, phi)
+
+    def forecast(self, steps):
+        horizon = np.arange(1, steps + 1)
+        damped = np.cumsum(self.phi ** horizon)
+        values = self.level + damped * self.trend
+        m = len(self.season)
+        if m:
+            values = values + self.season[(self.position + horizon - 1) % m]
+        return values
+
+
+class HoltWintersEngine:
+    name = "holt-winters"
+
+    def __init__(self, alpha=0.3, beta=0.01, gamma=0.1, phi=0.98):
+        self.alpha, self.beta, self.gamma, self.phi = alpha, beta, gamma, phi
+
+    def fit(self, values, period):
+        values = np.asarray(values, dtype=float)
+        # Seasonal initialisation needs two full seasons, otherwise fall back to Holt's method
+        m = period if len(values) >= 2 * period else 0
+        if m:
+            first, second = values[:m], values[m:2 * m]
+            level = first.mean()
+            trend = (second.mean() - level) / m
+            season = first - level
+        else:
+            level = values[0]
+            trend = values[1] - values[0] if len(values) > 1 else 0.0
+            season = np.zeros(0)
+        state = HoltWinters(level, trend, season, 0, self.alpha, self.beta, self.gamma, self.phi)
+        return state.extend(values)
+
+
+class FourierRegression:
+    def __init__(self, coefficients, period, harmonics, scale, offset):
+        self.coefficients = coefficients
+        self.period = period
+        self.harmonics = harmonics
+        self.scale = scale
+        self.offset = offset
+
+    def design(self, t):
+        columns = [np.ones_like(t), t / self.scale]
+        for k in range(1, self.harmonics + 1):
+            angle = 2 * np.pi * k * t / self.period
+            columns.extend([np.sin(angle), np.cos(angle)])
+        return np.column_stack(columns)
+
+    def forecast(self, steps):
+        t = np.arange(self.offset, self.offset + steps, dtype=float)
+        return self.design(t) @ self.coefficients
+
+    def extend(self, values):
+        return FourierRegression(self.coefficients, self.period, self.harmonics, self.scale, self.offset + len(values))
+
+
+class FourierEngine:
+    name = "fourier"
+
+    def __init__(self, harmonics=6):
+        self.harmonics = harmonics
+
+    def fit(self, values, period):
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        model = FourierRegression(None, period, min(self.harmonics, period // 2), max(n, 1), n)
+        coefficients, *_ = np.linalg.lstsq(model.design(np.arange(n, dtype=float)), values, rcond=None)
+        model.coefficients = coefficients
+        return model
+
+
+ENGINES = {}
+
+
+def register_engine(engine):
+    ENGINES[engine.name] = engine
+    return engine
+
+
+for _engine in (SarimaxEngine(), SeasonalNaiveEngine(), HoltWintersEngine(), FourierEngine()):
+    register_engine(_engine)
+
+DEFAULT_ENGINE = os.getenv("FORECAST_ENGINE", "sarimax")
+
+ENGINE_DESCRIPTION = "Forecasting engine: " + ", ".join(f"'{name}'" for name in ENGINES)
+
+
+def get_engine(name=None):
+    engine = ENGINES.get(name or DEFAULT_ENGINE)
+    if engine is None:
+        raise HTTPException(status_code=400, detail=f"Invalid engine. Use one of: {', '.join(ENGINES)}.")
+    return engine
+
+
+# Samples per day for each resample frequency, the seasonal period the fast engines use
+SEASONAL_PERIODS = {"1min": 1440, "15min": 96, "30min": 48, "1h": 24, "2h": 12}
+
+
+def engine_headers(timings):
+    # Fit time is zero when the model came from the cache
+    return {
+        "X-Forecast-Engine": timings["engine"],
+        "X-Forecast-Fit-Ms": f"{timings['fit_ms']:.1f}",
+        "X-Forecast-Predict-Ms": f"{timings['predict_ms']:.1f}",
+    }
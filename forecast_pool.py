@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+def _initialize(ready, initializer):
+    # Runs first in every worker process; reports the pid once the worker can take fits
+    initializer()
+    ready.put(os.getpid())
+
+
+class ForecastPool:
+    """Runs CPU-heavy model fits on a process pool with a bounded backlog.
+
+    At most ``max_pending`` fits may be queued or running at once; further
+    submissions are rejected with a 429 instead of piling up behind the pool,
+    unless the caller asks to block until a slot frees up.
+    With ``max_workers=0`` fits run inline in the calling thread.
+    Workers are started on the first submission, or all at once by ``start``.
+    """
+
+    def __init__(self, max_workers, max_pending, start_method="spawn"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self._initargs = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                        initializer=_initialize if self._initargs else None,
+                        initargs=self._initargs or (),
+                    )
+        return self._executor
+
+    def start(self, initializer=None, timeout=300):
+        """Starts every worker process and returns their pids once they are ready.
+
+        ``initializer`` runs in each worker before it takes any fits; it only
+        applies if the workers have not been started yet.
+        """
+        if self.max_workers == 0:
+            return set()
+        ready = None
+        with self._executor_lock:
+            if self._executor is None and initializer is not None:
+                ready = multiprocessing.get_context(self.start_method).Queue()
+                self._initargs = (ready, initializer)
+        # A spawn-context pool adds a process per submission while none is idle, so these skip
+        # the backlog slots: waiting for one would let a worker go idle and leave the rest unstarted
+        executor = self._get_executor()
+        futures = [executor.submit(os.getpid) for _ in range(self.max_workers)]
+        pids = {future.result() for future in futures}
+        if ready is None:
+            return pids
+        try:
+            return {ready.get(timeout=timeout) for _ in range(self.max_workers)}
+        except queue.Empty:
+            logging.error(f"Forecast pool workers not ready after {timeout}s")
+            return pids
+
+    def submit(self, fn, *args, block=False):
+        if not self._slots.acquire(blocking=block):
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Forecast queue is full, retry later.")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args, block=False):
+        if self.max_workers == 0:
+            return fn(*args)
+        return self.submit(fn, *args, block=block).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class JobRegistry:
+    """Runs forecast requests in the background and keeps their results for polling."""
+
+    def __init__(self, max_workers, max_pending, max_jobs=1000):
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="forecast-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pending(self):
+        return sum(1 for future in self._jobs.values() if not future.done())
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending() >= self.max_pending:
+                raise HTTPException(status_code=429, detail="Forecast job queue is full, retry later.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = self._executor.submit(fn, *args, **kwargs)
+            # Forget the oldest finished jobs once the registry is full
+            for old_id in [key for key, future in self._jobs.items() if future.done()]:
+                if len(self._jobs) <= self.max_jobs:
+                    break
+                del self._jobs[old_id]
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            raise HTTPException(status_code=404, detail=f"Unknown forecast job {job_id}.")
+        if future.running():
+            return {"job_id": job_id, "status": "running"}
+        if not future.done():
+            return {"job_id": job_id, "status": "pending"}
+        error = future.exception()
+        if error is None:
+            return {"job_id": job_id, "status": "done", "result": future.result()}
+        if isinstance(error, HTTPException):
+            return {"job_id": job_id, "status": "failed", "status_code": error.status_code, "detail": error.detail}
+        logging.error(f"Forecast job {job_id} failed: {error}")
+        return {"job_id": job_id, "status": "failed", "status_code": 500, "detail": str(error)}
+
+
+_workers = int(os.getenv("FORECAST_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+forecast_pool = ForecastPool(
+    max_workers=_workers,
+    max_pending=int(os.getenv("FORECAST_POOL_QUEUE", str(max(_workers, 1) * 2))),
+    start_method=os.getenv("FORECAST_POOL_START_METHOD", "spawn"),
+)
+
+forecast_jobs = JobRegistry(
+    max_workers=max(_workers, 1),
+    max_pending=int(os.getenv("FORECAST_JOB_QUEUE", "100")),
+)
@@ -0,0 +1,102 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage durations (ms) of the request being handled, in the order they ran
+_request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram per label, in Prometheus exposition format."""
+
+    def __init__(self, name, label, help):
+        self.name = name
+        self.label = label
+        self.help = help
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            counts, total = self._series.get(label_value, ([0] * (len(BUCKETS) + 1), 0.0))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._series[label_value] = (counts, total + seconds)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip((*BUCKETS, "+Inf"), counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {counts[-1]}")
+        return "\n".join(lines)
+
+
+stage_seconds = Histogram("forecast_stage_seconds", "stage", "Time spent per request stage.")
+request_seconds = Histogram("http_request_duration_seconds", "route", "Time spent handling requests per route.")
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(name, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+
+
+def server_timing(timings):
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+class TimedRoute(APIRoute):
+    """Route that times each request and reports its stages in a Server-Timing header."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request):
+            timings = {}
+            token = _request_timings.set(timings)
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+            finally:
+                _request_timings.reset(token)
+                elapsed = time.perf_counter() - started
+                request_seconds.observe(route, elapsed)
+            timings["total"] = elapsed * 1000
+            response.headers["Server-Timing"] = server_timing(timings)
+            return response
+
+        return timed_handler
+
+
+def render_metrics(counters=None):
+    parts = [stage_seconds.render(), request_seconds.render()]
+    for name, (help, value) in (counters or {}).items():
+        parts.append(f"# HELP {name} {help}\n# TYPE {name} counter\n{name} {value}")
+    return "\n".join(parts) + "\n"
+
+
+def log_event(logger, level, event, **fields):
+    # Formatting (which may include DataFrame reprs) only happens when the level is enabled
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s", event, " ".join(f"{key}={value}" for key, value in fields.items()))
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+
+# A fitted SARIMAX results object keeps the full filter output for every
+# observation (hundreds of MB for a 1440 point day series), so the cache only
+# stores a compact copy seeded with the state just before the last observation.
+def compact_results(results):
+    model = results.model
+    endog = np.asarray(model.endog)[-1:]
+    compact_model = model.clone(endog)
+    compact_model.ssm.initialize_known(
+        results.predicted_state[..., -2],
+        results.predicted_state_cov[..., -2],
+    )
+    return compact_model.filter(results.params)
+
+
+def fit_sarimax(values, order, seasonal_order, start_params=None):
+    # Runs in a forecast pool worker; only the compact results are sent back
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    results = SARIMAX(
+        np.asarray(values, dtype=float),
+        order=order,
+        seasonal_order=seasonal_order,
+        enforce_stationarity=False,
+        enforce_invertibility=False,
+    ).fit(start_params=start_params, disp=False)
+    return compact_results(results)
+
+
+def score_order(values, order, seasonal_order):
+    # Runs in a pool worker; returns only scalars and the parameter vector
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    started = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            results = SARIMAX(
+                np.asarray(values, dtype=float),
+                order=order,
+                seasonal_order=seasonal_order,
+                enforce_stationarity=False,
+                enforce_invertibility=False,
+            ).fit(disp=False)
+    except Exception as e:
+        return {"order": order, "seasonal_order": seasonal_order, "error": str(e)}
+    return {
+        "order": order,
+        "seasonal_order": seasonal_order,
+        "aic": float(results.aic),
+        "fit_seconds": time.perf_counter() - started,
+        "converged": bool(results.mle_retvals.get("converged", True)) if results.mle_retvals else True,
+        "start_params": [float(value) for value in results.params],
+    }
+
+
+def results_nbytes(results):
+    owners = (results.filter_results, results.model.ssm) if hasattr(results, "filter_results") else (results,)
+    total = 0
+    for owner in owners:
+        for value in vars(owner).values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+    return total
+
+
+class CacheEntry:
+    __slots__ = ("watermark", "results", "nbytes", "created_at", "last_index", "last_value", "fitted_at", "appended")
+
+    def __init__(self, watermark, results, nbytes, last_index, fitted_at=None, appended=0, last_value=None):
+        self.watermark = watermark
+        self.results = results
+        self.nbytes = nbytes
+        self.created_at = time.monotonic()
+        self.last_index = last_index
+        # The model's last observation, to notice revisions of that bucket
+        self.last_value = last_value
+        # Time of the last full parameter estimation and observations appended since
+        self.fitted_at = self.created_at if fitted_at is None else fitted_at
+        self.appended = appended
+
+
+class ModelCache:
+    """LRU cache of fitted forecast models, bounded by entry count and bytes.
+
+    When a cached model's series has grown, the new observations are filtered
+    into the existing state with the fitted parameters instead of refitting,
+    unless the model's last observation has changed since (a late reading in
+    that bucket), which needs a refit.
+    Parameters are re-estimated every ``refit_every`` appended observations,
+    after ``refit_interval`` seconds, or when the standardized one-step forecast
+    errors of the new observations exceed ``drift_threshold`` on average.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024, ttl=None,
+                 refit_every=1440, refit_interval=6 * 3600, drift_threshold=3.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.refit_every = refit_every
+        self.refit_interval = refit_interval
+        self.drift_threshold = drift_threshold
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.extends = 0
+        self.refits = 0
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.monotonic() - entry.created_at > self.ttl
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._drop(key)
+            return None
+        return entry
+
+    def get(self, key, watermark):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None or entry.watermark != watermark:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.results
+
+    def put(self, key, watermark, results, last_index=None, fitted_at=None, appended=0, last_value=None):
+        nbytes = results_nbytes(results)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = CacheEntry(watermark, results, nbytes, last_index, fitted_at, appended, last_value)
+            self._nbytes += nbytes
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _due_for_refit(self, entry, new_observations):
+        return (
+            entry.appended + new_observations > self.refit_every
+            or time.monotonic() - entry.fitted_at > self.refit_interval
+        )
+
+    def _drifted(self, results):
+        # Only state-space models report standardized errors; others refit on schedule
+        if not hasattr(results, "filter_results"):
+            return False
+        errors = results.filter_results.standardized_forecasts_error
+        errors = errors[np.isfinite(errors)]
+        return errors.size > 0 and np.abs(errors).mean() > self.drift_threshold
+
+    @staticmethod
+    def _same_value(cached, current):
+        return cached is not None and (cached == current or (np.isnan(cached) and np.isnan(current)))
+
+    def _extend(self, key, watermark, series, entry):
+        if entry.last_index is None or entry.last_index not in series.index:
+            return None
+        if not self._same_value(entry.last_value, float(series[entry.last_index])):
+            return None
+        new = series[series.index > entry.last_index]
+        if new.empty or self._due_for_refit(entry, len(new)):
+            return None
+        results = entry.results.extend(np.asarray(new, dtype=float))
+        if self._drifted(results):
+            return None
+        self.put(key, watermark, results, new.index[-1], entry.fitted_at, entry.appended + len(new), float(new.iloc[-1]))
+        with self._lock:
+            self.extends += 1
+        return results
+
+    def get_or_fit(self, key, watermark, series, fit):
+        # ``fit`` must return compact results (see fit_sarimax) or an engine model
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and entry.watermark == watermark:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.results
+            self.misses += 1
+
+        if entry is not None:
+            results = self._extend(key, watermark, series, entry)
+            if results is not None:
+                return results
+            with self._lock:
+                self.refits += 1
+
+        results = fit()
+        self.put(key, watermark, results, series.index[-1], last_value=float(series.iloc[-1]))
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "extends": self.extends,
+                "refits": self.refits,
+            }
+
+
+def _env_ttl():
+    ttl = os.getenv("FORECAST_CACHE_TTL")
+    return float(ttl) if ttl else None
+
+
+forecast_cache = ModelCache(
+    max_entries=int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "128")),
+    max_bytes=int(os.getenv("FORECAST_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=_env_ttl(),
+    refit_every=int(os.getenv("FORECAST_REFIT_EVERY", "1440")),
+    refit_interval=float(os.getenv("FORECAST_REFIT_INTERVAL", str(6 * 3600))),
+    drift_threshold=float(os.getenv("FORECAST_DRIFT_THRESHOLD", "3.0")),
+)
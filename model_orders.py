@@ -0,0 +1,259 @@
+"""Offline SARIMAX order selection per meter, forecast type and time period.
+
+For every series the forecast endpoints fit, the differencing orders d and
+D are fixed first (seasonal strength and an ADF unit-root test), because
+likelihoods under different differencing are not comparable. A grid of
+(p, q)(P, Q) orders with those d, D and the period's daily season s is
+then fitted across a process pool. Among the fits within the AIC tolerance
+of the best, each is timed again on its own and the fastest is stored with
+its fitted parameters. The SARIMAX engine then fits that order online,
+warm-started from those parameters:
+
+    python model_orders.py --periods day week --workers 8
+
+Imports router and test so that their forecast sources are registered.
+"""
+import argparse
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from engines import SEASONAL_PERIODS, SarimaxEngine, seasonal_order_for
+from forecast_pool import ForecastPool
+from model_cache import score_order
+from precompute import PERIODS, forecast_scheduler, period_start, utcnow
+from rdb.co import prediction_collection
+
+GRID = {
+    "p": (0, 1, 2),
+    "q": (0, 1, 2),
+    "P": (0, 1),
+    "Q": (0, 1),
+}
+
+# Seasonal strength above which the season is differenced (as nsdiffs in R's forecast)
+SEASONAL_STRENGTH = 0.64
+
+
+def seasonal_period(values, freq):
+    # The engine's daily season for the series, or 0 when it fits none
+    if freq is None:
+        return 0
+    return seasonal_order_for(len(values), SEASONAL_PERIODS[freq])[3]
+
+
+def differencing_orders(values, s, alpha=0.05, strength=SEASONAL_STRENGTH):
+    """(d, D) for a series, each 0 or 1.
+
+    D is 1 when the STL seasonal strength exceeds ``strength``; d is 1 when an
+    ADF test on the (seasonally differenced) series cannot reject a unit root.
+    """
+    from statsmodels.tsa.seasonal import STL
+    from statsmodels.tsa.stattools import adfuller
+
+    values = np.asarray(values, dtype=float)
+    D = 0
+    if s >= 2 and len(values) >= 2 * s:
+        fit = STL(values, period=s).fit()
+        remainder = np.var(fit.resid)
+        deseasoned = np.var(fit.seasonal + fit.resid)
+        D = int(deseasoned > 0 and 1 - remainder / deseasoned > strength)
+    differenced = values[s:] - values[:-s] if D else values
+    if np.ptp(differenced) == 0:
+        return 0, D
+    return int(adfuller(differenced, autolag="AIC")[1] > alpha), D
+
+
+def candidate_orders(d, D, s, grid=None):
+    grid = grid or GRID
+    orders = set()
+    for p, q, P, Q in itertools.product(grid["p"], grid["q"], grid["P"], grid["Q"]):
+        seasonal = (P, D, Q, s) if s and (P or D or Q) else (0, 0, 0, 0)
+        orders.add(((p, d, q), seasonal))
+    return sorted(orders)
+
+
+def shortlist(scores, aic_tolerance=2.0, limit=5):
+    """Converged fits whose AIC is within ``aic_tolerance`` of the best, best first.
+
+    Differences of a couple of AIC units are not meaningful, so among models
+    the data supports about equally the cheapest one to fit should win.
+    """
+    usable = [s for s in scores if "aic" in s and np.isfinite(s["aic"]) and s["converged"]]
+    if not usable:
+        return []
+    best = min(s["aic"] for s in usable)
+    return sorted((s for s in usable if s["aic"] <= best + aic_tolerance), key=lambda s: s["aic"])[:limit]
+
+
+class OrderStore:
+    """Chosen orders keyed by (source, id, meter, period), with a short-lived local copy.
+
+    Lookups are made on every SARIMAX fit, so results (including misses)
+    are kept in memory for ``ttl`` seconds.
+    """
+
+    def __init__(self, collection, ttl=300):
+        self.collection = collection
+        self.ttl = ttl
+        self._local = {}
+        self._lock = threading.Lock()
+        self._index_ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            self.collection.create_index(
+                [("source", ASCENDING), ("id", ASCENDING), ("meter", ASCENDING), ("period", ASCENDING)],
+                unique=True,
+                name="source_id_meter_period",
+            )
+        except PyMongoError as e:
+            logging.error(f"Could not create model order index: {e}")
+        self._index_ready = True
+
+    def save(self, source, id, meter, period, chosen, baseline=None, candidates=0):
+        self.ensure_index()
+        document = {
+            "order": list(chosen["order"]),
+            "seasonal_order": list(chosen["seasonal_order"]),
+            "start_params": chosen["start_params"],
+            "aic": chosen["aic"],
+            "fit_seconds": chosen["fit_seconds"],
+            "baseline": {key: baseline.get(key) for key in ("aic", "fit_seconds")} if baseline else None,
+            "candidates": candidates,
+            "tunedAt": utcnow(),
+        }
+        key = {"source": source, "id": id, "meter": meter, "period": period}
+        self.collection.update_one(key, {"$set": document}, upsert=True)
+        with self._lock:
+            self._local.pop((source, id, meter, period), None)
+        return document
+
+    def lookup(self, source, id, meter, period):
+        key = (source, id, meter, period)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._local.get(key)
+        if cached is not None and now - cached[0] <= self.ttl:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        try:
+            document = self.collection.find_one(
+                {"source": source, "id": id, "meter": meter, "period": period},
+                {"_id": 0, "order": 1, "seasonal_order": 1, "start_params": 1},
+            )
+        except PyMongoError as e:
+            # Fitting still works with the default order
+            logging.error(f"Model order lookup failed: {e}")
+            return None
+        with self._lock:
+            self._local[key] = (now, document)
+        return document
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+order_store = OrderStore(
+    prediction_collection.database["model_orders"],
+    ttl=float(os.getenv("MODEL_ORDERS_TTL", "300")),
+)
+
+
+def tuned_engine(engine, source, id, meter, period):
+    # A SARIMAX engine with the stored order and start parameters, when there are some
+    if not isinstance(engine, SarimaxEngine):
+        return engine
+    spec = order_store.lookup(source, id, meter, period)
+    if spec is None:
+        return engine
+    return SarimaxEngine(tuple(spec["order"]), tuple(spec["seasonal_order"]), spec.get("start_params"))
+
+
+def tune_series(pool, values, orders, aic_tolerance, baseline_order=None, repeat=1):
+    # Scores the grid in parallel, then times the shortlisted fits one after another
+    # so that fit times are not measured on a contended pool
+    grid = list(orders) + ([baseline_order] if baseline_order and baseline_order not in orders else [])
+    if pool.max_workers:
+        futures = [pool.submit(score_order, values, order, seasonal_order, block=True) for order, seasonal_order in grid]
+        scores = [future.result() for future in futures]
+    else:
+        # With no workers the pool runs everything inline
+        scores = [pool.run(score_order, values, order, seasonal_order) for order, seasonal_order in grid]
+    baseline = next((s for s in scores if (s["order"], s["seasonal_order"]) == baseline_order), None)
+    scores = [s for s in scores if (s["order"], s["seasonal_order"]) in orders]
+    timed = []
+    for candidate in shortlist(scores, aic_tolerance):
+        runs = [pool.run(score_order, values, candidate["order"], candidate["seasonal_order"], block=True) for _ in range(repeat)]
+        timed.append({**candidate, "fit_seconds": min(run.get("fit_seconds", np.inf) for run in runs)})
+    chosen = min(timed, key=lambda s: s["fit_seconds"]) if timed else None
+    return chosen, baseline, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--periods", nargs="+", default=list(PERIODS), choices=PERIODS)
+    parser.add_argument("--sources", nargs="+", default=None, help="Forecast sources to tune, e.g. forecast forecasting")
+    parser.add_argument("--meters", nargs="+", type=int, default=None, help="Defaults to the meters active in the last week")
+    parser.add_argument("--date", default=None, help="Tune on the period before this date (ISO format), default now")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Fit processes; 0 fits in this process")
+    parser.add_argument("--aic-tolerance", type=float, default=2.0)
+    parser.add_argument("--min-points", type=int, default=48)
+    parser.add_argument("--repeat", type=int, default=1, help="Sequential timing runs per shortlisted order")
+    args = parser.parse_args()
+    if args.workers < 0:
+        parser.error("--workers must be 0 or more")
+
+    logging.basicConfig(level=logging.INFO)
+    import router  # noqa: F401
+    import test  # noqa: F401
+
+    pool = ForecastPool(max_workers=args.workers, max_pending=args.workers * 4)
+    reference = datetime.fromisoformat(args.date) if args.date else utcnow()
+    sources = [s for s in forecast_scheduler.sources.values() if s.series is not None and (args.sources is None or s.name in args.sources)]
+    try:
+        for period in args.periods:
+            boundary = period_start(period, reference)
+            start, end = boundary - timedelta(days=1), boundary - timedelta(milliseconds=1)
+            for source in sources:
+                for kind in source.kinds:
+                    meters = args.meters or source.meters(kind, boundary - timedelta(days=7))
+                    id, _, _ = source.window(kind, period, start, end)
+                    for meter in meters:
+                        values = source.series(kind, meter, period, start, end)
+                        if np.isfinite(values).sum() < args.min_points:
+                            logging.info(f"Skipping {source.name} {kind} meter {meter} {period}: {len(values)} points")
+                            continue
+                        s = seasonal_period(values, source.frequencies.get(period))
+                        d, D = differencing_orders(values, s)
+                        # The engine's untuned specification, reported when it shares d and D
+                        default = ((1, 1, 1), (1, 1, 1, s) if s else (0, 0, 0, 0))
+                        chosen, baseline, scores = tune_series(pool, values, candidate_orders(d, D, s), args.aic_tolerance, default, args.repeat)
+                        if chosen is None:
+                            logging.error(f"No usable order for {source.name} {kind} meter {meter} {period}")
+                            continue
+                        comparable = baseline is not None and "aic" in baseline and (default[0][1], default[1][1]) == (d, D)
+                        order_store.save(source.name, id, meter, period, chosen, baseline if comparable else None, len(scores))
+                        print(
+                            f"{source.name:<12} {kind:<24} meter {meter:<5} {period:<6} d={d} D={D} s={s} "
+                            f"{chosen['order']}{chosen['seasonal_order']} aic {chosen['aic']:.1f} fit {chosen['fit_seconds']:.2f}s"
+                            + (f"  (default aic {baseline['aic']:.1f} fit {baseline['fit_seconds']:.2f}s)" if comparable else "  (default not comparable)")
+                        )
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
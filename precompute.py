@@ -0,0 +1,353 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from columnar import epoch_ms
+from engines import DEFAULT_ENGINE
+from forecast_pool import forecast_pool
+from rdb.co import prediction_collection
+
+PERIODS = ("day", "week", "month")
+
+
+def utcnow():
+    # Readings are stored as naive UTC datetimes
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def naive_utc(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo is not None else moment
+
+
+class ForecastStore:
+    """Precomputed forecasts, one document per run in their own collection.
+
+    A run document holds the forecast points and a ``run`` tag with the
+    period, window, engine and computation time, so runs for different
+    periods or engines never share documents. Publishing a run is a single
+    insert; older runs of the same window are deleted afterwards. A run is
+    fresh when its window had already closed when it was computed, or when
+    it is younger than ``max_age`` seconds.
+
+    Runs are looked up by the exact window the endpoint resolved, start and
+    end, so only requests for the window the scheduler forecast are served
+    from the store; any other window is fit live. Until some run exists,
+    lookups skip the database, rechecking every ``probe_interval`` seconds.
+    """
+
+    def __init__(self, collection, max_age=900, probe_interval=60):
+        self.collection = collection
+        self.max_age = max_age
+        self.probe_interval = probe_interval
+        self._index_ready = False
+        self._has_runs = False
+        self._probed_at = None
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+
+    def ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            self.collection.create_index(
+                [("meter", ASCENDING), ("id", ASCENDING), ("run.period", ASCENDING), ("run.window", ASCENDING),
+                 ("run.windowEnd", ASCENDING), ("run.engine", ASCENDING), ("run.computedAt", DESCENDING)],
+                name="meter_id_run_window",
+            )
+        except PyMongoError as e:
+            logging.error(f"Could not create precomputed forecast index: {e}")
+        self._index_ready = True
+
+    def has_runs(self):
+        if self._has_runs:
+            return True
+        now = time.monotonic()
+        if self._probed_at is not None and now - self._probed_at < self.probe_interval:
+            return False
+        self._probed_at = now
+        self._has_runs = self.collection.find_one({}, {"_id": 1}) is not None
+        return self._has_runs
+
+    @staticmethod
+    def run_filter(id, meter, period, window, window_end, engine):
+        return {
+            "meter": meter, "id": id, "run.period": period,
+            "run.window": naive_utc(window), "run.windowEnd": naive_utc(window_end), "run.engine": engine,
+        }
+
+    def save(self, id, meter, period, window, window_end, engine, records):
+        self.ensure_index()
+        computed_at = utcnow()
+        key = self.run_filter(id, meter, period, window, window_end, engine)
+        run = {
+            "id": uuid.uuid4().hex,
+            "period": period,
+            "window": key["run.window"],
+            "windowEnd": key["run.windowEnd"],
+            "engine": engine,
+            "computedAt": computed_at,
+            "closed": key["run.windowEnd"] <= computed_at,
+        }
+        self.collection.insert_one({
+            "meter": meter,
+            "id": id,
+            "run": run,
+            "points": [{**record, "id": id} for record in records],
+        })
+        self._has_runs = True
+        self.collection.delete_many({**key, "run.computedAt": {"$lt": computed_at}})
+        return run
+
+    def _latest(self, id, meter, period, window, window_end, engine, fields):
+        return self.collection.find_one(
+            self.run_filter(id, meter, period, window, window_end, engine),
+            {"_id": 0, **{field: 1 for field in fields}},
+            sort=[("run.computedAt", DESCENDING)],
+        )
+
+    def latest_run(self, id, meter, period, window, window_end, engine):
+        doc = self._latest(id, meter, period, window, window_end, engine, ("run",))
+        return doc["run"] if doc is not None else None
+
+    def fresh(self, run):
+        return run["closed"] or (utcnow() - run["computedAt"]).total_seconds() <= self.max_age
+
+    def load(self, id, meter, period, window, window_end, engine, exclude=()):
+        # The latest fresh run of exactly this window, its points in time order, or None
+        try:
+            if not self.has_runs():
+                self.misses += 1
+                return None
+            self.ensure_index()
+            doc = self._latest(id, meter, period, window, window_end, engine, ("run", "points"))
+        except PyMongoError as e:
+            # The live path still works without the store
+            logging.error(f"Precomputed forecast lookup failed: {e}")
+            return None
+        if doc is None:
+            self.misses += 1
+            return None
+        if not self.fresh(doc["run"]):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return [{key: value for key, value in point.items() if key not in exclude} for point in doc["points"]]
+
+    def stats(self):
+        return {"hits": self.hits, "stale": self.stale, "misses": self.misses, "max_age": self.max_age}
+
+
+def stored_columns(records):
+    # Columnar payload from stored forecast points
+    return {
+        "timestamps": epoch_ms(pd.DatetimeIndex([record["data"]["ds"] for record in records]).values),
+        "values": np.array([record["data"]["value"] for record in records], dtype=float),
+        "yhat": np.array([record["data"]["yhat"] for record in records], dtype=float),
+    }
+
+
+def period_start(period, moment):
+    # Boundaries follow the endpoints' windows: weeks start on Sunday
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=(day.weekday() + 1) % 7)
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown period {period}")
+
+
+class ForecastSource:
+    """A forecast endpoint the scheduler precomputes for.
+
+    ``meters(kind, since)`` lists the meters with readings since ``since``,
+    ``window(kind, period, start, end)`` returns the store id and the window
+    the endpoint resolves for a request, and ``compute(kind, meter, period,
+    start, end)`` fits that forecast and returns its records. ``series``
+    takes the same arguments and returns the resampled values the endpoint
+    fits, for offline model tuning; ``frequencies`` maps each period to the
+    resample frequency of those values.
+    """
+
+    def __init__(self, name, kinds, meters, window, compute, series=None, frequencies=None):
+        self.name = name
+        self.kinds = kinds
+        self.meters = meters
+        self.window = window
+        self.compute = compute
+        self.series = series
+        self.frequencies = frequencies or {}
+
+
+class ForecastScheduler:
+    """Precomputes forecasts for every active meter when a period closes.
+
+    At each day, week or month boundary the windows that just closed are
+    forecast for every meter with readings in the last ``active_window``.
+    Work is spread over ``workers`` threads. Each thread waits for a slot on
+    the forecast process pool, so fits run in parallel processes.
+    """
+
+    def __init__(self, store, engine, workers, periods=PERIODS, active_window=timedelta(days=7),
+                 poll=60, startup_delay=30, max_jobs=20):
+        self.store = store
+        self.engine = engine
+        self.workers = workers
+        self.periods = periods
+        self.active_window = active_window
+        self.poll = poll
+        self.startup_delay = startup_delay
+        self.sources = {}
+        self.completed = {}
+        self._jobs = deque(maxlen=max_jobs)
+        self._lock = threading.Lock()
+        self._runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-precompute")
+        self._thread = None
+
+    def register(self, source):
+        self.sources[source.name] = source
+        return source
+
+    def due(self, now=None):
+        now = now or utcnow()
+        return [period for period in self.periods if self.completed.get(period) != period_start(period, now)]
+
+    def trigger(self, period, boundary=None):
+        if period not in PERIODS:
+            raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
+        boundary = boundary or period_start(period, utcnow())
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "period": period,
+            "boundary": boundary,
+            "status": "pending",
+            "total": 0,
+            "done": 0,
+            "skipped": 0,
+            "failed": 0,
+            "started_at": None,
+            "finished_at": None,
+        }
+        with self._lock:
+            self._jobs.append(job)
+        self._runner.submit(self._run_job, job)
+        return job
+
+    def _run_job(self, job):
+        period, boundary = job["period"], job["boundary"]
+        # A reference inside the period that just closed; each source resolves its own window
+        start, end = boundary - timedelta(days=1), boundary - timedelta(milliseconds=1)
+        job.update(status="running", started_at=utcnow())
+        tasks = []
+        for source in list(self.sources.values()):
+            for kind in source.kinds:
+                try:
+                    meters = source.meters(kind, boundary - self.active_window)
+                except Exception as e:
+                    logging.error(f"Listing meters for {source.name} {kind} failed: {e}")
+                    continue
+                tasks.extend((source, kind, meter) for meter in meters)
+        job["total"] = len(tasks)
+
+        def count(key):
+            with self._lock:
+                job[key] += 1
+
+        def run(task):
+            source, kind, meter = task
+            try:
+                id, window, window_end = source.window(kind, period, start, end)
+                # Restarts don't redo forecasts of windows that were already closed
+                run = self.store.latest_run(id, meter, period, window, window_end, self.engine)
+                if run is not None and run["closed"]:
+                    return count("skipped")
+                records = source.compute(kind, meter, period, start, end)
+                self.store.save(id, meter, period, window, window_end, self.engine, records)
+                count("done")
+            except HTTPException as e:
+                # Meters without readings in the window end up here with a 404
+                if e.status_code == 404:
+                    return count("skipped")
+                count("failed")
+                logging.error(f"Precompute {source.name} {kind} meter {meter} failed: {e.detail}")
+            except Exception as e:
+                count("failed")
+                logging.error(f"Precompute {source.name} {kind} meter {meter} failed: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="forecast-precompute-meter") as executor:
+            list(executor.map(run, tasks))
+        job.update(status="done", finished_at=utcnow())
+        with self._lock:
+            if self.completed.get(period) is None or self.completed[period] < boundary:
+                self.completed[period] = boundary
+
+    def _loop(self):
+        time.sleep(self.startup_delay)
+        while True:
+            try:
+                now = utcnow()
+                with self._lock:
+                    running = {job["period"] for job in self._jobs if job["status"] in ("pending", "running")}
+                for period in self.due(now):
+                    if period not in running:
+                        self.trigger(period, period_start(period, now))
+            except Exception as e:
+                logging.error(f"Forecast precompute scheduling failed: {e}")
+            time.sleep(self.poll)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="forecast-scheduler", daemon=True)
+            self._thread.start()
+
+    def status(self):
+        now = utcnow()
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs]
+            completed = dict(self.completed)
+        periods = {}
+        for period in self.periods:
+            boundary = period_start(period, now)
+            last = completed.get(period)
+            periods[period] = {
+                "boundary": boundary,
+                "completed_boundary": last,
+                "stale": last != boundary,
+                "behind_seconds": (now - boundary).total_seconds() if last != boundary else 0.0,
+            }
+        return {"running": self._thread is not None, "periods": periods, "jobs": jobs, "store": self.store.stats()}
+
+
+forecast_store = ForecastStore(
+    prediction_collection.database["precomputed_forecasts"],
+    max_age=float(os.getenv("FORECAST_STORE_MAX_AGE", "900")),
+)
+
+forecast_scheduler = ForecastScheduler(
+    forecast_store,
+    engine=DEFAULT_ENGINE,
+    workers=max(forecast_pool.max_workers, 1),
+    periods=tuple(p for p in os.getenv("FORECAST_PRECOMPUTE_PERIODS", ",".join(PERIODS)).split(",") if p),
+    active_window=timedelta(days=float(os.getenv("FORECAST_ACTIVE_DAYS", "7"))),
+    poll=float(os.getenv("FORECAST_PRECOMPUTE_POLL", "60")),
+    startup_delay=float(os.getenv("FORECAST_PRECOMPUTE_DELAY", "30")),
+)
+
+
+def start_from_env():
+    # The scheduler thread only runs where FORECAST_PRECOMPUTE=1, e.g. a single worker
+    if os.getenv("FORECAST_PRECOMPUTE", "0") == "1":
+        forecast_scheduler.start()
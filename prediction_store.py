@@ -0,0 +1,106 @@
+import logging
+import os
+import queue
+import threading
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+DUPLICATE_KEY = 11000
+
+
+class PredictionWriter:
+    """Persists forecast points with one unordered bulk upsert per forecast.
+
+    Points are keyed by (meter, id, data.createdAt) and only inserted when
+    missing, so writing the same forecast twice is a no-op. With
+    ``write_behind`` enabled the bulk write runs on a background thread and
+    the caller returns immediately; when the queue is full the write falls
+    back to running inline.
+    """
+
+    def __init__(self, collection, write_behind=False, max_queue=256):
+        self.collection = collection
+        self.write_behind = write_behind
+        self._index_ready = False
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            self.collection.create_index(
+                [("meter", ASCENDING), ("id", ASCENDING), ("data.createdAt", ASCENDING)],
+                unique=True,
+                name="meter_id_createdAt",
+            )
+        except PyMongoError as e:
+            logging.error(f"Could not create prediction index: {e}")
+        self._index_ready = True
+
+    def write(self, forecasts):
+        if not forecasts:
+            return
+        if self.write_behind:
+            self._start_worker()
+            try:
+                self._queue.put_nowait(forecasts)
+                return
+            except queue.Full:
+                logging.warning("Prediction write-behind queue full, writing inline.")
+        self._bulk_upsert(forecasts)
+
+    def _bulk_upsert(self, forecasts):
+        self.ensure_index()
+        operations = [
+            UpdateOne(
+                {
+                    "meter": forecast["meter"],
+                    "id": forecast["id"],
+                    "data.createdAt": forecast["data"]["createdAt"],
+                },
+                {"$setOnInsert": forecast},
+                upsert=True,
+            )
+            for forecast in forecasts
+        ]
+        try:
+            return self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Concurrent upserts of the same point race on the unique index; the
+            # losers' documents already exist so only other errors matter.
+            errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+            if errors:
+                logging.error(f"Prediction bulk write failed: {errors[:3]}")
+                raise
+
+    def _start_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            forecasts = self._queue.get()
+            try:
+                self._bulk_upsert(forecasts)
+            except Exception as e:
+                logging.error(f"Write-behind prediction write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
+
+
+def writer_from_env(collection):
+    return PredictionWriter(
+        collection,
+        write_behind=os.getenv("PREDICTION_WRITE_BEHIND", "0") == "1",
+        max_queue=int(os.getenv("PREDICTION_WRITE_QUEUE", "256")),
+    )
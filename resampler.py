@@ -0,0 +1,199 @@
+from datetime import timezone
+
+import numpy as np
+import pandas as pd
+from starlette.concurrency import run_in_threadpool
+
+from async_db import iter_batches
+from columnar import read_columns
+
+_NO_TIME_LAST = np.iinfo(np.int64).min
+_NO_TIME_FIRST = np.iinfo(np.int64).max
+
+
+def _naive_utc(moment):
+    moment = pd.Timestamp(moment)
+    return moment.tz_convert(timezone.utc).tz_localize(None) if moment.tzinfo is not None else moment
+
+
+class StreamingResampler:
+    """Running per-bucket aggregates over readings added in chunks.
+
+    Buckets of ``freq`` cover ``start`` to ``end``; memory is a few arrays of
+    that many buckets however many readings are added, and readings may
+    arrive in any order. NaN readings are skipped by the aggregates but,
+    like in pandas, carried by ``asof``, unless ``fill`` replaces them.
+    ``tail`` keeps the last that many readings (by time) for callers that
+    need raw values.
+    """
+
+    def __init__(self, start, end, freq, fill=None, tail=0):
+        self.freq = freq
+        self.step = pd.Timedelta(freq).value // 1_000_000
+        self.origin = _naive_utc(start).floor(freq)
+        self.origin_ms = self.origin.value // 1_000_000
+        buckets = max((_naive_utc(end).value // 1_000_000 - self.origin_ms) // self.step + 1, 1)
+        self.fill = fill
+        self.rows = 0
+        self.valid = 0
+        self.invalid_times = 0
+        self.last_time = None
+        # Buckets holding any reading, NaN or not; ``count`` only counts values
+        self.seen = np.zeros(buckets, dtype=bool)
+        self.count = np.zeros(buckets, dtype=np.int64)
+        self.sum = np.zeros(buckets)
+        self.min = np.full(buckets, np.inf)
+        self.max = np.full(buckets, -np.inf)
+        self.first = np.full(buckets, np.nan)
+        self.first_ts = np.full(buckets, _NO_TIME_FIRST, dtype=np.int64)
+        self.last = np.full(buckets, np.nan)
+        self.last_ts = np.full(buckets, _NO_TIME_LAST, dtype=np.int64)
+        # Latest reading per bucket and the reading exactly on its left edge,
+        # NaN or not, for as-of lookups
+        self.latest = np.full(buckets, np.nan)
+        self.latest_ts = np.full(buckets, _NO_TIME_LAST, dtype=np.int64)
+        self.at_label = np.full(buckets, np.nan)
+        self.on_label = np.zeros(buckets, dtype=bool)
+        self.tail_size = tail
+        self.tail_ts = np.empty(0, dtype=np.int64)
+        self.tail_values = np.empty(0)
+
+    @classmethod
+    def from_columns(cls, columns, freq, fill=None, tail=0):
+        if columns.timestamps.size:
+            start, end = columns.timestamps[0], columns.timestamps[-1]
+        else:
+            start = end = pd.Timestamp(0)
+        resampler = cls(start, end, freq, fill=fill, tail=tail)
+        resampler.add(columns.timestamps, columns.values)
+        return resampler
+
+    def add_documents(self, documents, value_path=("data", "value")):
+        columns = read_columns(documents, value_path=value_path)
+        self.add(columns.timestamps, columns.values)
+
+    def add(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype="datetime64[ms]")
+        values = np.asarray(values, dtype=np.float64)
+        self.rows += timestamps.size
+        bad = np.isnat(timestamps)
+        if bad.any():
+            self.invalid_times += int(bad.sum())
+            timestamps, values = timestamps[~bad], values[~bad]
+        if not timestamps.size:
+            return
+        finite = ~np.isnan(values)
+        self.valid += int(finite.sum())
+        if self.fill is not None:
+            values = np.where(finite, values, self.fill)
+            finite = np.ones(values.size, dtype=bool)
+
+        times = timestamps.astype(np.int64)
+        newest = timestamps.max()
+        self.last_time = newest if self.last_time is None else max(self.last_time, newest)
+        if self.tail_size:
+            self._add_tail(times, values)
+
+        offsets = times - self.origin_ms
+        index = offsets // self.step
+        inside = (index >= 0) & (index < self.count.size)
+        times, values, index, offsets, finite = times[inside], values[inside], index[inside], offsets[inside], finite[inside]
+        if not times.size:
+            return
+        self.seen[index] = True
+
+        # Sorted by bucket, then time, so each bucket's first and last reading are its group's ends
+        order = np.lexsort((times, index))
+        index, times, values, offsets, finite = index[order], times[order], values[order], offsets[order], finite[order]
+        self._update_ends(index, times, values, None, self.latest, self.latest_ts)
+        on_edge = offsets % self.step == 0
+        self.at_label[index[on_edge]] = values[on_edge]
+        self.on_label[index[on_edge]] = True
+
+        index, times, values = index[finite], times[finite], values[finite]
+        if not times.size:
+            return
+        np.add.at(self.count, index, 1)
+        np.add.at(self.sum, index, values)
+        np.minimum.at(self.min, index, values)
+        np.maximum.at(self.max, index, values)
+        self._update_ends(index, times, values, (self.first, self.first_ts), self.last, self.last_ts)
+
+    def _update_ends(self, index, times, values, first, last, last_ts):
+        edges = np.flatnonzero(np.diff(index)) + 1
+        lasts = np.concatenate((edges - 1, [index.size - 1]))
+        buckets = index[lasts]
+        newer = times[lasts] >= last_ts[buckets]
+        last[buckets[newer]] = values[lasts][newer]
+        last_ts[buckets[newer]] = times[lasts][newer]
+        if first is not None:
+            first, first_ts = first
+            firsts = np.concatenate(([0], edges))
+            buckets = index[firsts]
+            older = times[firsts] < first_ts[buckets]
+            first[buckets[older]] = values[firsts][older]
+            first_ts[buckets[older]] = times[firsts][older]
+
+    def _add_tail(self, times, values):
+        times = np.concatenate((self.tail_ts, times))
+        values = np.concatenate((self.tail_values, values))
+        if times.size > self.tail_size:
+            keep = np.argpartition(times, times.size - self.tail_size)[-self.tail_size:]
+            times, values = times[keep], values[keep]
+        order = np.argsort(times, kind="stable")
+        self.tail_ts, self.tail_values = times[order], values[order]
+
+    def _span(self):
+        filled = np.flatnonzero(self.seen)
+        if not filled.size:
+            return 0, 0
+        return filled[0], filled[-1] + 1
+
+    def column(self, how):
+        """Values per bucket for the whole window, NaN where nothing applies.
+
+        ``how`` is first, last, mean, min, max or count, or ``asof``: the
+        latest reading at or before each bucket's left edge, which is what
+        ``Series.resample(freq).ffill()`` returns.
+        """
+        empty = self.count == 0
+        if how == "count":
+            return self.count.astype(float)
+        if how == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(empty, np.nan, self.sum / self.count)
+        if how == "min":
+            return np.where(empty, np.nan, self.min)
+        if how == "max":
+            return np.where(empty, np.nan, self.max)
+        if how == "first":
+            return self.first.copy()
+        if how == "last":
+            return self.last.copy()
+        if how == "asof":
+            positions = np.arange(self.count.size)
+            # Latest bucket with readings strictly before each bucket; buckets
+            # before the first reading have nothing to carry and stay NaN
+            previous = np.maximum.accumulate(np.where(self.seen, positions, -1))
+            previous = np.concatenate(([-1], previous[:-1]))
+            carried = np.where(previous >= 0, self.latest[np.maximum(previous, 0)], np.nan)
+            return np.where(self.on_label, self.at_label, carried)
+        raise ValueError(f"Unknown aggregate {how}")
+
+    def index(self, start=0, stop=None):
+        stop = self.count.size if stop is None else stop
+        # Millisecond resolution, like an index built from the decoded columns
+        labels = (self.origin_ms + np.arange(start, stop, dtype=np.int64) * self.step).astype("datetime64[ms]")
+        return pd.DatetimeIndex(labels, freq=self.freq)
+
+    def series(self, how="asof", name="y"):
+        # Buckets from the first to the last one holding readings, like DataFrame.resample
+        start, stop = self._span()
+        return pd.Series(self.column(how)[start:stop], index=self.index(start, stop), name=name)
+
+
+async def stream_resample(collection, query, projection, resampler, value_path=("data", "value"), batch_size=1000):
+    # Decoding runs in the thread pool one batch at a time; only one batch of documents is alive
+    async for batch in iter_batches(collection, query, projection, batch_size):
+        await run_in_threadpool(resampler.add_documents, batch, value_path)
+    return resampler
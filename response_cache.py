@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+def records_nbytes(records):
+    # Records share one shape, so the first one's dicts, timestamp and value stand for all
+    if not records:
+        return 0
+    record = records[0]
+    data = record["data"]
+    size = sys.getsizeof(record) + sys.getsizeof(data) + sys.getsizeof(data["createdAt"]) + sys.getsizeof(data["value"])
+    return size * len(records)
+
+
+class ResponseEntry:
+    __slots__ = ("records", "nbytes", "watermark", "closed")
+
+    def __init__(self, records, nbytes, watermark, closed):
+        self.records = records
+        self.nbytes = nbytes
+        # createdAt the next incremental fetch resumes from
+        self.watermark = watermark
+        self.closed = closed
+
+
+class ResponseCache:
+    """LRU cache of raw data endpoint responses, bounded by entries and estimated bytes.
+
+    Windows that lie fully in the past never change and are served from the
+    cache as is; open windows keep a watermark so only newer readings are
+    fetched on the next request. Those fetches start ``overlap`` before the
+    watermark and replace the cached records from there, so readings that
+    arrive late or share the watermark's millisecond are not lost.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, grace=timedelta(minutes=5), overlap=timedelta(minutes=5)):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.overlap = overlap
+        self._entries = OrderedDict()
+        self._records = 0
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def window_closed(self, end):
+        # Readings can arrive a little late, so a window only closes after the grace period
+        now = datetime.now(timezone.utc)
+        if end.tzinfo is None:
+            now = now.replace(tzinfo=None)
+        return end <= now - self.grace
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._records -= len(entry.records)
+        self._nbytes -= entry.nbytes
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.closed:
+                self.hits += 1
+            else:
+                self.refreshes += 1
+            return entry
+
+    def put(self, key, records, watermark, closed):
+        nbytes = records_nbytes(records)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = ResponseEntry(records, nbytes, watermark, closed)
+            self._records += len(records)
+            self._nbytes += nbytes
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._records = 0
+            self._nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "records": self._records,
+                "bytes": self._nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    grace=timedelta(seconds=float(os.getenv("RESPONSE_CACHE_GRACE", "300"))),
+    overlap=timedelta(seconds=float(os.getenv("RESPONSE_CACHE_OVERLAP", "300"))),
+)
@@ -1,12 +1,38 @@
-from fastapi import APIRouter, Query, HTTPException
-from datetime import datetime, timedelta
+from fastapi import APIRouter, Query, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+import asyncio, json, os, time
+import numpy as np
 import pandas as pd
-from statsmodels.tsa.stattools import adfuller
 import logging ,random
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo.errors import ExecutionTimeout
 from Database.config import kilowatt_collection , current_collection , voltage_collection ,db
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-
-TestRouter = APIRouter()
+from model_cache import forecast_cache
+from response_cache import response_cache
+from async_db import QUERY_TIMEOUT_MS, aggregate_all, find_all
+from columnar import ColumnarResponse, Columns, epoch_ms, read_columns, split_by_meter, thin_columns
+from engines import ENGINE_DESCRIPTION, SEASONAL_PERIODS, engine_headers, get_engine
+from forecast_pool import forecast_pool, forecast_jobs
+from instrumentation import TimedRoute, log_event, render_metrics, stage
+from resampler import StreamingResampler, stream_resample
+from precompute import ForecastSource, forecast_scheduler, forecast_store, start_from_env, stored_columns
+from singleflight import forecast_flight
+from model_orders import tuned_engine
+from warmup import prewarm_from_env
+from series_store import series_store
+
+TestRouter = APIRouter(route_class=TimedRoute)
+TestRouter.add_event_handler("startup", prewarm_from_env)
+
+logger = logging.getLogger(__name__)
+
+# Documents pulled from the cursor per round trip (and per streamed chunk)
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
 
 def parse_iso_datetime(iso_str: str) -> datetime:
    
@@ -15,207 +41,337 @@ def parse_iso_datetime(iso_str: str) -> datetime:
     except ValueError as e:
         raise ValueError(f"Invalid date format: {iso_str}. Error: {str(e)}")
 
-def get_data(collection, start_date: datetime, end_date: datetime, meter: int):
-   
+def data_query(start_date: datetime, end_date: datetime, meter: int):
+    return (
+        {
+            "createdAt": {"$gte": start_date, "$lte": end_date},
+            "meter": meter
+        },
+        {"_id": 0, "data.value": 1, "createdAt": 1, "meter": 1},
+    )
+
+def iter_data(collection, start_date: datetime, end_date: datetime, meter: int, batch_size: int = STREAM_BATCH_SIZE):
+    query, projection = data_query(start_date, end_date, meter)
+    return collection.find(query, projection, batch_size=batch_size).max_time_ms(QUERY_TIMEOUT_MS)
+
+def get_columns(collection, start_date: datetime, end_date: datetime, meter: int):
+    # Recent windows come straight from the workers' shared series store
+    stored = series_store.read(collection.full_name, meter, "value", start_date, end_date)
+    if stored is not None:
+        return stored
     try:
-        data = collection.find(
-            {
-                "createdAt": {"$gte": start_date, "$lte": end_date},
-                "meter": meter
-            },
-            {"_id": 0, "data.value": 1, "createdAt": 1, "meter": 1}
-        )
-        return list(data)
+        return read_columns(iter_data(collection, start_date, end_date, meter))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Database query timed out.")
     except Exception as e:
         logging.error(f"Database query failed: {e}")
         raise HTTPException(status_code=500, detail="Database query error.")
-    
-@TestRouter.get("/current-data")
-def current_data(
-    start_time: str = Query(...),
-    end_time: str = Query(...),
-    meter_ID: int = Query(...),
-    type: str = Query(..., description="Type of forecast data to include ('forecast-current-data' or 'forecast-voltage-data')"),
-    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')")
-):
-    start = parse_iso_datetime(start_time)
-    end = parse_iso_datetime(end_time)
 
-    if time_period == "day":
+async def resample_data(collection, start_date: datetime, end_date: datetime, meter: int, freq: str, **options):
+    # Bucketed aggregates of the window, built batch by batch without holding the raw readings
+    resampler = StreamingResampler(start_date, end_date, freq, **options)
+    stored = series_store.read(collection.full_name, meter, "value", start_date, end_date)
+    if stored is not None:
+        await run_in_threadpool(resampler.add, stored.timestamps, stored.values)
+        return resampler
+    try:
+        return await stream_resample(collection, *data_query(start_date, end_date, meter), resampler, batch_size=STREAM_BATCH_SIZE)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Database query timed out.")
+    except Exception as e:
+        logging.error(f"Database query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database query error.")
+
+# Accumulators available for server-side downsampling
+BUCKET_AGGREGATES = {"first": "$first", "mean": "$avg", "min": "$min", "max": "$max"}
+
+# Spacing between points returned for each time period
+DOWNSAMPLE_GAPS = {"week": timedelta(minutes=30), "month": timedelta(hours=2)}
+
+def bucket_pipeline(start_date: datetime, end_date: datetime, meter: int, bucket: timedelta, aggregate: str):
+    # One point per bucket, computed by the database so only the buckets are transferred
+    minutes = int(bucket.total_seconds() // 60)
+    unit, bin_size = ("hour", minutes // 60) if minutes % 60 == 0 else ("minute", minutes)
+    return [
+        {"$match": {"createdAt": {"$gte": start_date, "$lte": end_date}, "meter": meter}},
+        {"$sort": {"createdAt": 1}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$createdAt", "unit": unit, "binSize": bin_size}},
+            "meter": {"$first": "$meter"},
+            "value": {BUCKET_AGGREGATES[aggregate]: "$data.value"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "meter": 1, "createdAt": "$_id", "data": {"value": "$value"}}},
+    ]
+
+def iter_bucketed_data(collection, start_date: datetime, end_date: datetime, meter: int, bucket: timedelta, aggregate: str, batch_size: int = STREAM_BATCH_SIZE):
+    return collection.aggregate(
+        bucket_pipeline(start_date, end_date, meter, bucket, aggregate),
+        allowDiskUse=True, batchSize=batch_size, maxTimeMS=QUERY_TIMEOUT_MS,
+    )
 
+def resolve_window(start: datetime, end: datetime, time_period: str):
+    if time_period == "day":
         pass
     elif time_period == "week":
-
         start = start - timedelta(days=(start.weekday() + 1) % 7)
         end = start + timedelta(days=7)  
     elif time_period == "month":
-       
         start = start.replace(day=1) 
-       
-        next_month = start.replace(day=28) + timedelta(days=4) 
-        end = next_month - timedelta(days=next_month.day)  
+        next_month = start.replace(day=28) + timedelta(days=4)
+        end = next_month - timedelta(days=next_month.day) 
     else:
         raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
+    return start, end
+
+def response_record(record):
+    return {
+        "meter": record.get("meter"),
+        "data": {
+            "value": record.get("data", {}).get("value"),
+            "createdAt": record.get("createdAt")
+        }
+    }
+
+def stream_ndjson(records, batch_size: int = STREAM_BATCH_SIZE):
+    # Serialize as the cursor is consumed, one chunk per batch of records
+    lines = []
+    try:
+        for record in records:
+            lines.append(json.dumps(jsonable_encoder(record)))
+            if len(lines) >= batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+    except Exception as e:
+        logging.error(f"Streaming response failed: {e}")
+        raise
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+async def fetch_records(collection, start_date: datetime, end_date: datetime, meter: int, gap, aggregate, cached=None):
+    # Returns the window's response records and the watermark to resume from,
+    # fetching only what is newer than ``cached`` when given
+    records = cached.records if cached is not None else []
+    if gap is not None and aggregate is not None:
+        # Buckets from the overlap on may still change, the last one is filling up
+        since = start_date
+        if cached is not None:
+            since = min(record["data"]["createdAt"] for record in records if record["data"]["createdAt"] >= cached.watermark - response_cache.overlap)
+        records = [record for record in records if record["data"]["createdAt"] < since]
+        buckets = await aggregate_all(collection, bucket_pipeline(since, end_date, meter, gap, aggregate), STREAM_BATCH_SIZE)
+        records += map(response_record, buckets)
+        return records, records[-1]["data"]["createdAt"] if records else None
+
+    watermark = cached.watermark if cached is not None else None
+    since = start_date
+    if watermark is not None:
+        # Readings from the overlap on are fetched again and replace the cached ones,
+        # picking up late arrivals and readings in the watermark's millisecond
+        window_start = start_date.astimezone(timezone.utc).replace(tzinfo=None) if start_date.tzinfo else start_date
+        since = max(watermark - response_cache.overlap, window_start)
+        records = [record for record in records if record["data"]["createdAt"] < since]
+
+    def tracked(data):
+        nonlocal watermark
+        for record in data:
+            created_at = record.get("createdAt")
+            if watermark is None or created_at > watermark:
+                watermark = created_at
+            yield response_record(record)
+
+    documents = await find_all(collection, *data_query(since, end_date, meter), STREAM_BATCH_SIZE)
+    new_records = tracked(documents)
+    if gap is not None:
+        last_time = records[-1]["data"]["createdAt"] if records else None
+        new_records = iter_time_gap(new_records, gap, last_time)
+    records = records + list(new_records)
+    return records, watermark
+
+async def cached_records(collection, start_date: datetime, end_date: datetime, meter: int, time_period: str, gap, aggregate):
+    key = (collection.full_name, meter, start_date, end_date, time_period, aggregate)
+    cached = response_cache.get(key)
+    if cached is not None and cached.closed:
+        return cached.records
+    closed = response_cache.window_closed(end_date)
+    records, watermark = await fetch_records(collection, start_date, end_date, meter, gap, aggregate, cached)
+    if records:
+        response_cache.put(key, records, watermark, closed)
+    return records
+
+async def window_columns(collection, start_date: datetime, end_date: datetime, meter: int, gap, aggregate):
+    # The window's readings as sorted columns, thinned or bucketed like the records
+    stored = series_store.read(collection.full_name, meter, "value", start_date, end_date) if aggregate is None else None
+    if stored is not None:
+        data = stored
+    elif gap is not None and aggregate is not None:
+        documents = await aggregate_all(collection, bucket_pipeline(start_date, end_date, meter, gap, aggregate), STREAM_BATCH_SIZE)
+        data = await run_in_threadpool(read_columns, documents)
+    else:
+        documents = await find_all(collection, *data_query(start_date, end_date, meter), STREAM_BATCH_SIZE)
+        data = await run_in_threadpool(read_columns, documents)
+    if gap is not None and aggregate is None:
+        data = thin_columns(data, gap)
+    return data
+
+async def meter_data_response(collection, label: str, start_time: str, end_time: str, meter_ID: int, type: str, time_period: str, aggregate, format: str = "json"):
+    start = parse_iso_datetime(start_time)
+    end = parse_iso_datetime(end_time)
+
+    # Adjust time ranges based on the time period
+    start, end = resolve_window(start, end, time_period)
+
+    if aggregate is not None and aggregate not in BUCKET_AGGREGATES:
+        raise HTTPException(status_code=400, detail="Invalid aggregate. Use 'first', 'mean', 'min', or 'max'.")
+    if format not in ("json", "ndjson", "columnar"):
+        raise HTTPException(status_code=400, detail="Invalid format. Use 'json', 'ndjson' or 'columnar'.")
 
-    print(f"Current Data - Start: {start}, End: {end}, Meter: {meter_ID}, Type: {type}, Time Period: {time_period}")
+    log_event(logger, logging.DEBUG, f"{label.lower()}_data_request", start=start, end=end, meter=meter_ID, type=type, time_period=time_period)
 
-    data = get_data(current_collection, start, end, meter_ID)
+    gap = DOWNSAMPLE_GAPS.get(time_period)
+    try:
+        with stage("get_data"):
+            if format == "json":
+                # Served from the response cache, fetching only readings past its watermark
+                response_data = await cached_records(collection, start, end, meter_ID, time_period, gap, aggregate)
+                first = response_data[0] if response_data else None
+            elif format == "columnar":
+                response_data = await window_columns(collection, start, end, meter_ID, gap, aggregate)
+                first = response_data.timestamps[0] if response_data.timestamps.size else None
+            else:
+                if gap is not None and aggregate is not None:
+                    data = iter_bucketed_data(collection, start, end, meter_ID, gap, aggregate)
+                else:
+                    data = iter_data(collection, start, end, meter_ID)
+
+                # Prepare the response records lazily so they can be streamed
+                response_data = (response_record(record) for record in data)
+
+                # Adjust for time gaps based on the time period
+                if gap is not None and aggregate is None:
+                    response_data = iter_time_gap(response_data, gap)
+
+                first = await run_in_threadpool(next, response_data, None)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Database query timed out.")
+    except Exception as e:
+        logging.error(f"Database query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database query error.")
 
-    if not data:
+    if first is None:
         raise HTTPException(
             status_code=404, 
-            detail=f"No current data found for meter {meter_ID} within the given time range."
+            detail=f"No {label.lower()} data found for meter {meter_ID} within the given time range."
         )
 
-
-    response_data = []
-    for record in data:
-        created_at = record.get("createdAt")
-        value = record.get("data", {}).get("value")
-
-        response_data.append({
-            "meter": record.get("meter"),
-            "data": {
-                "value": value,
-                "createdAt": created_at
-            }
-        })
-
-    if time_period == "week":
-        response_data = adjust_for_time_gap(response_data, timedelta(minutes=30))
-    elif time_period == "month":
-        response_data = adjust_for_time_gap(response_data, timedelta(hours=2))
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(chain([first], response_data)), media_type="application/x-ndjson")
+    if format == "columnar":
+        return ColumnarResponse({"meter": meter_ID, "timestamps": epoch_ms(response_data.timestamps), "values": response_data.values})
 
     return {"data": response_data}
 
+AGGREGATE_DESCRIPTION = "Downsample week/month data in the database, one point per bucket ('first', 'mean', 'min' or 'max')"
+FORMAT_DESCRIPTION = "Response format: 'json' (default), 'ndjson' to stream one record per line or 'columnar' for parallel epoch-ms timestamp/value arrays"
 
-@TestRouter.get("/voltage-data")
-def voltage_data(
+@TestRouter.get("/current-data")
+async def current_data(
     start_time: str = Query(...),
     end_time: str = Query(...),
     meter_ID: int = Query(...),
     type: str = Query(..., description="Type of forecast data to include ('forecast-current-data' or 'forecast-voltage-data')"),
-    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')")
+    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')"),
+    aggregate: Optional[str] = Query(None, description=AGGREGATE_DESCRIPTION),
+    format: str = Query("json", description=FORMAT_DESCRIPTION)
 ):
-    start = parse_iso_datetime(start_time)
-    end = parse_iso_datetime(end_time)
-
-    if time_period == "day":
-        pass
-    elif time_period == "week":
-        start = start - timedelta(days=(start.weekday() + 1) % 7)
-        end = start + timedelta(days=7)  
-    elif time_period == "month":
-        start = start.replace(day=1) 
-        next_month = start.replace(day=28) + timedelta(days=4)
-        end = next_month - timedelta(days=next_month.day) 
-    else:
-        raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
-
-    print(f"Voltage Data - Start: {start}, End: {end}, Meter: {meter_ID}, Type: {type}, Time Period: {time_period}")
-
-    data = get_data(voltage_collection, start, end, meter_ID)
-
-    if not data:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"No voltage data found for meter {meter_ID} within the given time range."
-        )
+    return await meter_data_response(current_collection, "Current", start_time, end_time, meter_ID, type, time_period, aggregate, format)
 
-    response_data = []
-    for record in data:
-        created_at = record.get("createdAt")
-        value = record.get("data", {}).get("value")
-
-        response_data.append({
-            "meter": record.get("meter"),
-            "data": {
-                "value": value,
-                "createdAt": created_at
-            }
-        })
 
-    if time_period == "week":
-        response_data = adjust_for_time_gap(response_data, timedelta(minutes=30))
-    elif time_period == "month":
-        response_data = adjust_for_time_gap(response_data, timedelta(hours=2))
-
-    return {"data": response_data}
+@TestRouter.get("/voltage-data")
+async def voltage_data(
+    start_time: str = Query(...),
+    end_time: str = Query(...),
+    meter_ID: int = Query(...),
+    type: str = Query(..., description="Type of forecast data to include ('forecast-current-data' or 'forecast-voltage-data')"),
+    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')"),
+    aggregate: Optional[str] = Query(None, description=AGGREGATE_DESCRIPTION),
+    format: str = Query("json", description=FORMAT_DESCRIPTION)
+):
+    return await meter_data_response(voltage_collection, "Voltage", start_time, end_time, meter_ID, type, time_period, aggregate, format)
     
 @TestRouter.get("/kilowatt-data")
-def kilowatt_data(
+async def kilowatt_data(
     start_time: str = Query(...),
     end_time: str = Query(...),
     meter_ID: int = Query(...),
     type: str = Query(..., description="Type of forecast data to include ('forecast-kilowatt-data')"),
-    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')")
+    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')"),
+    aggregate: Optional[str] = Query(None, description=AGGREGATE_DESCRIPTION),
+    format: str = Query("json", description=FORMAT_DESCRIPTION)
 ):
-    # Parse the start and end times
-    start = parse_iso_datetime(start_time)
-    end = parse_iso_datetime(end_time)
-
-    # Adjust time ranges based on the time period
-    if time_period == "day":
-        pass
-    elif time_period == "week":
-        start = start - timedelta(days=(start.weekday() + 1) % 7)
-        end = start + timedelta(days=7)  
-    elif time_period == "month":
-        start = start.replace(day=1)
-        next_month = start.replace(day=28) + timedelta(days=4)
-        end = next_month - timedelta(days=next_month.day) 
-    else:
-        raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
-
-    print(f"Kilowatt Data - Start: {start}, End: {end}, Meter: {meter_ID}, Type: {type}, Time Period: {time_period}")
-
     # Fetch data from the KILOWATT_AVG collection
     kilowatt_collection = db["KILOWATT_AVG"]
-    data = get_data(kilowatt_collection, start, end, meter_ID)
+    return await meter_data_response(kilowatt_collection, "Kilowatt", start_time, end_time, meter_ID, type, time_period, aggregate, format)
 
-    # Check if data is found
-    if not data:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"No kilowatt data found for meter {meter_ID} within the given time range."
-        )
+# Collections combined by /meter-data
+METRIC_COLLECTIONS = {"current": current_collection, "voltage": voltage_collection, "kilowatt": db["KILOWATT_AVG"]}
 
-    # Prepare the response
-    response_data = []
-    for record in data:
-        created_at = record.get("createdAt")
-        value = record.get("data", {}).get("value")
-
-        response_data.append({
-            "meter": record.get("meter"),
-            "data": {
-                "value": value,
-                "createdAt": created_at
-            }
-        })
+# Spacing of the shared time grid for each time period
+GRID_FREQUENCIES = {"day": "1min", "week": "30min", "month": "2h"}
 
-    # Adjust for time gaps based on the time period
-    if time_period == "week":
-        response_data = adjust_for_time_gap(response_data, timedelta(minutes=30))
-    elif time_period == "month":
-        response_data = adjust_for_time_gap(response_data, timedelta(hours=2))
+GRID_AGGREGATES = ("first", "last", "mean", "min", "max")
 
-    return {"data": response_data}
+def align_columns(resampled, aggregate: str):
+    # Every metric shares its resampler's grid, from the window start to the newest reading
+    last = max(data.last_time for data in resampled.values() if data.last_time is not None)
+    first = next(iter(resampled.values()))
+    stop = int((last.astype(np.int64) - first.origin_ms) // first.step) + 1
+    grid = first.index(0, stop)
+    return grid, {name: data.column(aggregate)[:stop] for name, data in resampled.items()}
+
+@TestRouter.get("/meter-data")
+async def meter_data(
+    start_time: str = Query(...),
+    end_time: str = Query(...),
+    meter_ID: int = Query(...),
+    time_period: str = Query(..., description="Time period for data ('day', 'week', 'month')"),
+    aggregate: str = Query("first", description="Reduction per grid interval ('first', 'last', 'mean', 'min' or 'max')"),
+):
+    # Current, voltage and kilowatt for one meter on a shared grid, as one column per metric
+    start, end = resolve_window(parse_iso_datetime(start_time), parse_iso_datetime(end_time), time_period)
+    if aggregate not in GRID_AGGREGATES:
+        raise HTTPException(status_code=400, detail="Invalid aggregate. Use 'first', 'last', 'mean', 'min', or 'max'.")
+    freq = GRID_FREQUENCIES[time_period]
+
+    with stage("get_data"):
+        fetched = await asyncio.gather(*(
+            resample_data(collection, start, end, meter_ID, freq) for collection in METRIC_COLLECTIONS.values()
+        ))
+    if not any(data.rows for data in fetched):
+        raise HTTPException(status_code=404, detail=f"No data found for meter {meter_ID} within the given time range.")
+
+    with stage("align"):
+        grid, aligned = align_columns(dict(zip(METRIC_COLLECTIONS, fetched)), aggregate)
+    return ColumnarResponse({
+        "meter": meter_ID,
+        "interval": freq,
+        "start": grid[0].isoformat(),
+        "count": len(grid),
+        "data": aligned,
+    })
 
 # Function to adjust for time gaps
 def adjust_for_time_gap(data, gap):
     
-    adjusted_data = []
-    last_time = None
+    return list(iter_time_gap(data, gap))
+
+def iter_time_gap(data, gap, last_time=None):
     
     for record in data:
         created_at = record["data"]["createdAt"]
         
         if last_time is None or created_at >= last_time + gap:
-            adjusted_data.append(record)
+            yield record
             last_time = created_at
-    
-    return adjusted_data
 
 def generate_forecast_sarima(df_resampled, time_period):
     if time_period == 'day':
@@ -230,10 +386,10 @@ def generate_forecast_sarima(df_resampled, time_period):
     else:
       raise ValueError("Invalid time period. Please choose 'day', 'week', or 'month'.")
 
-    print(f"Forecast Index Frequency: {freq}")
+    log_event(logger, logging.DEBUG, "forecast_index", freq=freq)
 
     if df_resampled['y'].isna().all():
-        print("No actual data available. Generating default forecast.")
+        log_event(logger, logging.INFO, "default_forecast", reason="no actual data")
         forecast_index = pd.date_range(
             start=df_resampled.index[-1] + pd.Timedelta(freq),
             periods=forecast_periods,
@@ -244,7 +400,7 @@ def generate_forecast_sarima(df_resampled, time_period):
         return pd.Series(forecast_values, index=forecast_index)
 
     if df_resampled['y'].notna().sum() < 48:  
-        print("Insufficient data. Falling back to a default forecast.")
+        log_event(logger, logging.INFO, "default_forecast", reason="insufficient data")
         forecast_values = [df_resampled['y'].iloc[-1]] * forecast_periods
         forecast_index = pd.date_range(
             start=df_resampled.index[-1] + pd.Timedelta(freq),
@@ -253,7 +409,9 @@ def generate_forecast_sarima(df_resampled, time_period):
         )
         return pd.Series(forecast_values, index=forecast_index)
 
-    # Fit SARIMA
+    # Fit SARIMA; statsmodels is only imported once a model is fitted
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
     model = SARIMAX(
         df_resampled['y'],
         order=(1, 1, 1),
@@ -274,100 +432,330 @@ def generate_forecast_sarima(df_resampled, time_period):
     
 
 
-@TestRouter.get("/forecast")
-def forecast_data(
-    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
-    meterID: int = Query(...),
-    startDate: str = Query(...),
-    endDate: str = Query(...),
-    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
-):
-    try:
-        
-        start = parse_iso_datetime(startDate)
-        end = parse_iso_datetime(endDate)
-        print(f"Parsed Dates - Start: {start}, End: {end}")
-
-        if type == "forecast-kilowatt-data":
-            collection = kilowatt_collection  
-        elif type == "forecast-current-data":
-            collection = current_collection  
-        elif type == "forecast-voltage-data":
-            collection = voltage_collection  
-        else:
-            raise HTTPException(status_code=400, detail="Invalid forecast type. Use 'forecast-kilowatt-data', 'forecast-current-data', or 'forecast-voltage-data'.")
-
-        if timePeriod == "week":
-            start = start - timedelta(days=start.weekday() + 1)
-            end = start + timedelta(days=6)
-        elif timePeriod == "month":
-            start = start.replace(day=1)
-            end = (start.replace(month=start.month % 12 + 1, day=1) - timedelta(days=1))
-        elif timePeriod == "day":
-            pass
-        else:
-            raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
-
-        data = get_data(collection, start, end, meterID)
-        if not data:
-            raise HTTPException(status_code=404, detail=f"No data found for meter {meterID} within the given time range.")
-
-        df = pd.DataFrame(data)
-        df['ds'] = pd.to_datetime(df['createdAt'])
-        df['y'] = df['data'].apply(lambda x: x['value'])
-        df.set_index('ds', inplace=True)
-
-        if timePeriod == 'day':
-            df_resampled = df.resample('1min').ffill()
-            forecast_periods = 1440
-            freq = '1min'
-        elif timePeriod == 'week':
-            df_resampled = df.resample('30min').ffill()
-            forecast_periods = 336
-            freq = '30min'
-        elif timePeriod == 'month':
-            df_resampled = df.resample('2h').ffill()
-            forecast_periods = 720
-            freq = '2h'
-        else:
-            raise HTTPException(status_code=400, detail="Invalid time period.")
-
-        df_resampled['y'] = df_resampled['y'].fillna(0)
+FORECAST_TYPE_ERROR = "Invalid forecast type. Use 'forecast-kilowatt-data', 'forecast-current-data', or 'forecast-voltage-data'."
 
-        try:
-            model = SARIMAX(
-                df_resampled['y'],
-                order=(1, 1, 1),
-                seasonal_order=(1, 1, 1, 24),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
+# Resample frequency and forecast horizon for each time period
+FORECAST_RESOLUTIONS = {"day": ("1min", 1440), "week": ("30min", 336), "month": ("2h", 720)}
+
+def forecast_collection(type: str):
+    if type == "forecast-kilowatt-data":
+        return kilowatt_collection  
+    elif type == "forecast-current-data":
+        return current_collection  
+    elif type == "forecast-voltage-data":
+        return voltage_collection  
+    raise HTTPException(status_code=400, detail=FORECAST_TYPE_ERROR)
+
+def resolve_forecast_window(start: datetime, end: datetime, timePeriod: str):
+    if timePeriod == "week":
+        start = start - timedelta(days=start.weekday() + 1)
+        end = start + timedelta(days=6)
+    elif timePeriod == "month":
+        start = start.replace(day=1)
+        end = (start.replace(month=start.month % 12 + 1, day=1) - timedelta(days=1))
+    elif timePeriod == "day":
+        pass
+    else:
+        raise HTTPException(status_code=400, detail="Invalid time period. Use 'day', 'week', or 'month'.")
+    return start, end
+
+def forecast_meter(type: str, meterID: int, timePeriod: str, start: datetime, data, block: bool = False, engine: Optional[str] = None, timings: Optional[dict] = None, format: str = "json"):
+    # ``data`` holds the meter's readings as timestamp/value columns, or already resampled
+    if timePeriod not in FORECAST_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Invalid time period.")
+    forecaster = tuned_engine(get_engine(engine), "forecast", type, meterID, timePeriod)
+    freq, forecast_periods = FORECAST_RESOLUTIONS[timePeriod]
+    if isinstance(data, Columns):
+        with stage("resample"):
+            data = StreamingResampler.from_columns(data, freq)
+    if not data.rows:
+        raise HTTPException(status_code=404, detail=f"No data found for meter {meterID} within the given time range.")
+    with stage("resample"):
+        y_resampled = data.series("asof").fillna(0)
+
+    # Reuse the fitted model, filtering in only the readings that arrived since it was cached
+    watermark = (data.last_time, data.rows)
+    fit_started = time.perf_counter()
+    try:
+        with stage("fit"):
+            model_fit = forecast_cache.get_or_fit(
+                ("forecast", forecaster.name, type, meterID, timePeriod, start),
+                watermark,
+                y_resampled,
+                lambda: forecast_pool.run(
+                    forecaster.fit,
+                    y_resampled.to_numpy(dtype=float),
+                    SEASONAL_PERIODS[freq],
+                    block=block,
+                ),
             )
-            model_fit = model.fit(disp=False)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error in SARIMA model fitting: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in {forecaster.name} model fitting: {e}")
+    fit_ms = (time.perf_counter() - fit_started) * 1000
 
-        forecast_index = pd.date_range(
-            start=df_resampled.index[-1] + pd.Timedelta(freq),
-            periods=forecast_periods,
-            freq=freq,
-        )
+    forecast_index = pd.date_range(
+        start=y_resampled.index[-1] + pd.Timedelta(freq),
+        periods=forecast_periods,
+        freq=freq,
+    )
+    predict_started = time.perf_counter()
+    with stage("forecast"):
         forecast_values = model_fit.forecast(steps=forecast_periods)
+    if timings is not None:
+        timings.update(engine=forecaster.name, fit_ms=fit_ms, predict_ms=(time.perf_counter() - predict_started) * 1000)
 
+    with stage("response"):
+        if format == "columnar":
+            last = y_resampled.iloc[-1] if len(y_resampled) > 0 else 0
+            return {
+                "meter": meterID,
+                "timestamps": epoch_ms(forecast_index.values),
+                "values": np.full(len(forecast_index), last, dtype=float),
+                "yhat": np.asarray(forecast_values, dtype=float),
+            }
         forecasted_data = []
         for date, value in zip(forecast_index, forecast_values):
             yhat = value + random.uniform(-0.000 * value, 0.000 * value)  
             forecasted_data.append({
                 "meter": meterID,
                 "data": {
-                    "value": df_resampled['y'][-1] if len(df_resampled) > 0 else 0,  
+                    "value": y_resampled.iloc[-1] if len(y_resampled) > 0 else 0,  
                     "createdAt": date.isoformat(),
                     "yhat": yhat,
                     "ds": date.isoformat()
                 }
             })
 
+    return forecasted_data
+
+
+FORECAST_TYPES = ("forecast-kilowatt-data", "forecast-current-data", "forecast-voltage-data")
+
+def active_meters(type: str, since: datetime):
+    return forecast_collection(type).distinct("meter", {"createdAt": {"$gte": since}})
+
+def precompute_window(type: str, period: str, start: datetime, end: datetime):
+    start, end = resolve_forecast_window(start, end, period)
+    return type, start, end
+
+def precompute_forecast(type: str, meter: int, period: str, start: datetime, end: datetime):
+    start, end = resolve_forecast_window(start, end, period)
+    data = get_columns(forecast_collection(type), start, end, meter)
+    return forecast_meter(type, meter, period, start, data, block=True)
+
+def precompute_series(type: str, meter: int, period: str, start: datetime, end: datetime):
+    start, end = resolve_forecast_window(start, end, period)
+    data = StreamingResampler.from_columns(get_columns(forecast_collection(type), start, end, meter), FORECAST_RESOLUTIONS[period][0])
+    return data.series("asof").fillna(0).to_numpy(dtype=float)
+
+# Precomputed /forecast points are stored with the forecast type as their id
+forecast_scheduler.register(ForecastSource(
+    "forecast", FORECAST_TYPES, active_meters, precompute_window, precompute_forecast, precompute_series,
+    {period: freq for period, (freq, _) in FORECAST_RESOLUTIONS.items()},
+))
+start_from_env()
+
+def series_readings(collection):
+    # These collections hold a single metric per reading
+    return lambda meter, metric, start_date, end_date: (collection, *data_query(start_date, end_date, meter), ("data", "value"))
+
+for series_collection in (kilowatt_collection, current_collection, voltage_collection, *METRIC_COLLECTIONS.values()):
+    series_store.register(series_collection.full_name, series_readings(series_collection))
+series_store.start()
+
+
+def forecast_window(type: str, meterID: int, startDate: str, endDate: str, timePeriod: str):
+    start = parse_iso_datetime(startDate)
+    end = parse_iso_datetime(endDate)
+    log_event(logger, logging.DEBUG, "forecast_request", start=start, end=end, type=type, meter=meterID, time_period=timePeriod)
+
+    collection = forecast_collection(type)
+    start, end = resolve_forecast_window(start, end, timePeriod)
+    return collection, start, end
+
+
+def run_forecast(type: str, meterID: int, startDate: str, endDate: str, timePeriod: str, engine: Optional[str] = None):
+    # Synchronous /forecast for background jobs
+    collection, start, end = forecast_window(type, meterID, startDate, endDate, timePeriod)
+    data = get_columns(collection, start, end, meterID)
+    return {"data": forecast_meter(type, meterID, timePeriod, start, data, engine=engine)}
+
+
+async def forecast_payload(collection, type: str, meterID: int, timePeriod: str, start: datetime, end: datetime, engine: str, format: str):
+    # Serve a fresh precomputed forecast when the scheduler has one
+    with stage("store"):
+        stored = await run_in_threadpool(forecast_store.load, type, meterID, timePeriod, start, end, engine, ("id",))
+    if stored is not None:
+        if format == "columnar":
+            stored = {"meter": meterID, **stored_columns(stored)}
+        return stored, {"X-Forecast-Source": "precomputed"}
+
+    with stage("get_data"):
+        data = await resample_data(collection, start, end, meterID, FORECAST_RESOLUTIONS[timePeriod][0])
+    timings = {}
+    # Resampling and fitting block, so they run in a worker thread
+    forecasted_data = await run_in_threadpool(forecast_meter, type, meterID, timePeriod, start, data, engine=engine, timings=timings, format=format)
+    return forecasted_data, engine_headers(timings)
+
+
+@TestRouter.get("/forecast")
+async def forecast_data(
+    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
+    meterID: int = Query(...),
+    startDate: str = Query(...),
+    endDate: str = Query(...),
+    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
+    engine: Optional[str] = Query(None, description=ENGINE_DESCRIPTION),
+    format: str = Query("json", description="Response format: 'json' (default) or 'columnar' for parallel epoch-ms timestamp/value/yhat arrays"),
+    response: Response = None,
+):
+    try:
+        if format not in ("json", "columnar"):
+            raise HTTPException(status_code=400, detail="Invalid format. Use 'json' or 'columnar'.")
+        collection, start, end = forecast_window(type, meterID, startDate, endDate, timePeriod)
+        engine = get_engine(engine).name
+
+        # Identical concurrent requests share one query and fit
+        key = ("forecast", type, meterID, timePeriod, start, end, engine, format)
+        forecasted_data, headers = await forecast_flight.run(key, forecast_payload, collection, type, meterID, timePeriod, start, end, engine, format)
+        if format == "columnar":
+            return ColumnarResponse(forecasted_data, headers=headers)
+        if response is not None:
+            response.headers.update(headers)
         return {"data": forecasted_data}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+def group_fleet_data(collection, start_date: datetime, end_date: datetime, meters: List[int]):
+    # One query for every meter, split into per-meter series in memory
+    try:
+        cursor = collection.find(
+            {
+                "createdAt": {"$gte": start_date, "$lte": end_date},
+                "meter": {"$in": meters}
+            },
+            {"_id": 0, "data.value": 1, "createdAt": 1, "meter": 1},
+            batch_size=STREAM_BATCH_SIZE
+        ).max_time_ms(QUERY_TIMEOUT_MS)
+        columns = read_columns(cursor, with_meter=True)
+    except Exception as e:
+        logging.error(f"Database query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database query error.")
+    return split_by_meter(columns, meters)
+
+@TestRouter.get("/forecast/batch")
+def forecast_batch(
+    meterIDs: List[int] = Query(..., description="Meters to forecast, repeat the parameter for each meter"),
+    types: List[str] = Query(..., description="Forecast types to include for every meter"),
+    startDate: str = Query(...),
+    endDate: str = Query(...),
+    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
+    engine: Optional[str] = Query(None, description=ENGINE_DESCRIPTION),
+):
+    get_engine(engine)
+    start = parse_iso_datetime(startDate)
+    end = parse_iso_datetime(endDate)
+    start, end = resolve_forecast_window(start, end, timePeriod)
+    meters = list(dict.fromkeys(meterIDs))
+    collections = {type: forecast_collection(type) for type in dict.fromkeys(types)}
+
+    series = {type: group_fleet_data(collection, start, end, meters) for type, collection in collections.items()}
+
+    # Fits wait for a pool slot instead of being rejected, so the batch drains at pool speed
+    executor = ThreadPoolExecutor(max_workers=max(forecast_pool.max_workers, 1), thread_name_prefix="forecast-batch")
+    timings = {(type, meter): {} for type in collections for meter in meters}
+    futures = {
+        executor.submit(forecast_meter, type, meter, timePeriod, start, series[type][meter], True, engine, timings[type, meter]): (type, meter)
+        for type in collections
+        for meter in meters
+    }
+
+    def results():
+        try:
+            for future in as_completed(futures):
+                type, meter = futures[future]
+                try:
+                    line = {"type": type, "meter": meter, "data": future.result(), "timings": timings[type, meter]}
+                except HTTPException as e:
+                    line = {"type": type, "meter": meter, "status_code": e.status_code, "detail": e.detail}
+                except Exception as e:
+                    logging.error(f"Batch forecast failed for meter {meter}: {e}")
+                    line = {"type": type, "meter": meter, "status_code": 500, "detail": str(e)}
+                yield json.dumps(jsonable_encoder(line)) + "\n"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@TestRouter.post("/forecast/jobs")
+def submit_forecast_job(
+    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
+    meterID: int = Query(...),
+    startDate: str = Query(...),
+    endDate: str = Query(...),
+    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
+    engine: Optional[str] = Query(None, description=ENGINE_DESCRIPTION),
+):
+    get_engine(engine)
+    job_id = forecast_jobs.submit(
+        run_forecast, type=type, meterID=meterID, startDate=startDate, endDate=endDate, timePeriod=timePeriod, engine=engine
+    )
+    return {"job_id": job_id, "status": "pending"}
+
+
+@TestRouter.get("/forecast/jobs/{job_id}")
+def forecast_job_status(job_id: str):
+    return forecast_jobs.status(job_id)
+
+
+@TestRouter.get("/forecast/cache-stats")
+def forecast_cache_stats():
+    return forecast_cache.stats()
+
+
+@TestRouter.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    stats = forecast_cache.stats()
+    counters = {
+        f"forecast_model_cache_{key}_total": (f"Model cache {key}.", stats[key])
+        for key in ("hits", "misses", "evictions", "extends", "refits")
+    }
+    counters["forecast_pool_rejected_total"] = ("Forecast fits rejected with 429.", forecast_pool.rejected)
+    responses = response_cache.stats()
+    counters.update({
+        f"response_cache_{key}_total": (f"Raw data response cache {key}.", responses[key])
+        for key in ("hits", "misses", "refreshes", "evictions")
+    })
+    flights = forecast_flight.stats()
+    counters["forecast_requests_coalesced_total"] = ("Forecast requests served by another identical in-flight request.", flights["coalesced"])
+    counters["forecast_requests_computed_total"] = ("Forecast requests that ran their own computation.", flights["leaders"])
+    store = forecast_store.stats()
+    counters.update({
+        f"forecast_store_{key}_total": (f"Precomputed forecast lookups, {key}.", store[key])
+        for key in ("hits", "stale", "misses")
+    })
+    series = series_store.stats()
+    counters.update({
+        f"series_store_{key}_total": (f"Shared series store {key}.", series[key])
+        for key in ("hits", "stale", "misses", "refreshes", "writes")
+    })
+    return PlainTextResponse(render_metrics(counters), media_type="text/plain; version=0.0.4")
+
+
+@TestRouter.post("/forecast/precompute")
+def trigger_precompute(period: str = Query(..., description="Period whose just-closed windows to precompute: 'day', 'week' or 'month'")):
+    job = forecast_scheduler.trigger(period)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@TestRouter.get("/forecast/precompute")
+def precompute_status():
+    return forecast_scheduler.status()
@@ -0,0 +1,359 @@
+"""Recent per-meter, per-metric readings shared by every worker on a host.
+
+Series are kept as files under SERIES_STORE_DIR (ideally a tmpfs such as
+/dev/shm) and memory-mapped by readers, so all uvicorn workers share one copy
+of the pages instead of each holding its own arrays. Each series has a JSON
+manifest naming its current data file: room for ``capacity`` int64
+millisecond timestamps followed by room for as many values, of which the
+first ``rows`` are filled.
+
+A single worker, whichever holds the lock on ``writer.lock``, refreshes the
+series: it fetches readings from shortly before the last sync, writes new
+readings into the free rows of the file and publishes them by atomically
+replacing the manifest with a larger ``rows``. Rows a reader already sees
+are never written again. Only when the file is full, or stored readings
+were revised, does the writer trim readings past the retention into a new
+file. Readers keep their mapping while the manifest names the same file,
+and every worker unmaps replaced files once per poll interval. Workers mark
+the series they read under ``wanted/``, and series nobody has read for
+``idle`` seconds are dropped.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from pymongo.errors import PyMongoError
+
+from async_db import QUERY_TIMEOUT_MS
+from columnar import COLUMN_DTYPE, Columns, read_columns
+from instrumentation import log_event
+from precompute import utcnow
+
+try:
+    import fcntl
+except ImportError:  # the store needs POSIX file locks; it stays disabled without them
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_TIMESTAMP_DTYPE = np.dtype(np.int64)
+_MIN_CAPACITY = 1024
+
+
+def to_ms(moment, ceil=False):
+    # Milliseconds since the epoch of a naive-UTC or aware datetime
+    moment = pd.Timestamp(moment)
+    if moment.tzinfo is not None:
+        moment = moment.tz_convert("UTC").tz_localize(None)
+    return -(-moment.value // 1_000_000) if ceil else moment.value // 1_000_000
+
+
+def slug(source, meter, metric):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", f"{source}-{meter}-{metric}")
+
+
+class SeriesStore:
+    """Memory-mapped series keyed by (source, meter, metric).
+
+    ``sources`` map a name to a function of (meter, metric, start, end)
+    returning the collection, query, projection and value path of those
+    readings. A read is served from the store when the window starts after
+    the series' first retained reading and ends before its last sync, or
+    the sync is at most ``max_lag`` seconds old.
+    """
+
+    def __init__(self, directory, retention=35 * 86400, poll=30, idle=86400, max_lag=None, overlap=300):
+        self.directory = directory
+        self.retention = retention
+        self.poll = poll
+        self.idle = idle
+        self.max_lag = 2 * poll if max_lag is None else max_lag
+        self.overlap = overlap
+        self.sources = {}
+        self._maps = {}
+        self._wanted = {}
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+        self.writes = 0
+
+    @property
+    def enabled(self):
+        return self.directory is not None and fcntl is not None
+
+    def register(self, name, readings):
+        self.sources[name] = readings
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _write_json(self, path, document):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(document, f)
+        os.replace(temporary, path)
+
+    def _manifest(self, name):
+        try:
+            with open(self._path(f"{name}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _open(self, name):
+        # The series' current (manifest, timestamps, values), mapped read-only
+        for _ in range(2):
+            manifest = self._manifest(name)
+            if manifest is None:
+                return None
+            rows = manifest["rows"]
+            with self._lock:
+                cached = self._maps.get(name)
+            if cached is not None and cached[0]["file"] == manifest["file"]:
+                return manifest, cached[1][:rows], cached[2][:rows]
+            capacity = manifest["capacity"]
+            try:
+                path = self._path(manifest["file"])
+                timestamps = np.memmap(path, dtype=_TIMESTAMP_DTYPE, mode="r", shape=(capacity,))
+                values = np.memmap(path, dtype=manifest["dtype"], mode="r", offset=capacity * _TIMESTAMP_DTYPE.itemsize, shape=(capacity,))
+            except FileNotFoundError:
+                # Replaced between reading the manifest and mapping its file
+                continue
+            with self._lock:
+                self._maps[name] = (manifest, timestamps, values)
+            return manifest, timestamps[:rows], values[:rows]
+        return None
+
+    def _evict(self):
+        # Unmaps files the writer has since replaced or dropped, so their pages can be freed
+        with self._lock:
+            names = list(self._maps)
+        for name in names:
+            manifest = self._manifest(name)
+            with self._lock:
+                cached = self._maps.get(name)
+                if cached is not None and (manifest is None or cached[0]["file"] != manifest["file"]):
+                    del self._maps[name]
+
+    def _want(self, name, source, meter, metric):
+        # Marks the series as read, at most once per poll interval per process
+        now = time.monotonic()
+        if now - self._wanted.get(name, -self.poll) < self.poll:
+            return
+        self._wanted[name] = now
+        marker = self._path("wanted", name)
+        try:
+            os.utime(marker)
+        except FileNotFoundError:
+            self._write_json(marker, {"source": source, "meter": meter, "metric": metric})
+
+    def read(self, source, meter, metric, start, end):
+        """Columns of the window as views of the shared pages, or None to query the database."""
+        if not self.enabled or source not in self.sources:
+            return None
+        name = slug(source, meter, metric)
+        try:
+            self._want(name, source, meter, metric)
+            opened = self._open(name)
+        except OSError as e:
+            logging.error(f"Series store read failed: {e}")
+            return None
+        start_ms, end_ms = to_ms(start, ceil=True), to_ms(end)
+        if opened is None or start_ms < opened[0]["since"]:
+            self.misses += 1
+            return None
+        manifest, timestamps, values = opened
+        if manifest["synced"] < min(end_ms, to_ms(utcnow()) - int(self.max_lag * 1000)):
+            self.stale += 1
+            return None
+        first, last = np.searchsorted(timestamps, start_ms, side="left"), np.searchsorted(timestamps, end_ms, side="right")
+        self.hits += 1
+        return Columns(timestamps[first:last].view("datetime64[ms]"), values[first:last])
+
+    def _fetch(self, source, meter, metric, start, end):
+        collection, query, projection, value_path = self.sources[source](meter, metric, start, end)
+        columns = read_columns(collection.find(query, projection).max_time_ms(QUERY_TIMEOUT_MS), value_path=value_path)
+        return columns.timestamps.astype(np.int64), columns.values.astype(COLUMN_DTYPE, copy=False)
+
+    def _write(self, name, version, timestamps, values, since, synced):
+        # A new data file with room to append as many rows again as it holds
+        capacity = max(2 * timestamps.size, _MIN_CAPACITY)
+        manifest = {
+            "version": version, "file": f"{name}.{version}.bin", "rows": int(timestamps.size), "capacity": capacity,
+            "dtype": values.dtype.str, "since": since, "synced": synced,
+        }
+        with open(self._path(manifest["file"]), "wb") as f:
+            f.write(timestamps.tobytes())
+            f.seek(capacity * _TIMESTAMP_DTYPE.itemsize)
+            f.write(values.tobytes())
+            f.truncate(capacity * (_TIMESTAMP_DTYPE.itemsize + values.dtype.itemsize))
+        return manifest
+
+    def _append(self, manifest, timestamps, values):
+        # Fills free rows only; readers see them once the manifest's rows include them
+        rows, capacity, dtype = manifest["rows"], manifest["capacity"], np.dtype(manifest["dtype"])
+        with open(self._path(manifest["file"]), "r+b") as f:
+            f.seek(rows * _TIMESTAMP_DTYPE.itemsize)
+            f.write(timestamps.astype(_TIMESTAMP_DTYPE, copy=False).tobytes())
+            f.seek(capacity * _TIMESTAMP_DTYPE.itemsize + rows * dtype.itemsize)
+            f.write(values.astype(dtype, copy=False).tobytes())
+        return {**manifest, "rows": rows + int(timestamps.size)}
+
+    def refresh_series(self, source, meter, metric):
+        name = slug(source, meter, metric)
+        now = utcnow()
+        now_ms = to_ms(now)
+        horizon = now_ms - int(self.retention * 1000)
+        opened = self._open(name)
+        if opened is None:
+            manifest, timestamps, values = {"version": 0, "file": None}, np.empty(0, dtype=np.int64), np.empty(0)
+            since = fetch_from = horizon
+        else:
+            manifest, timestamps, values = opened
+            since = manifest["since"]
+            fetch_from = max(manifest["synced"] - int(self.overlap * 1000), since)
+        timestamps, values = np.asarray(timestamps), np.asarray(values)
+        fetched_ts, fetched_values = self._fetch(
+            source, meter, metric,
+            pd.Timestamp(fetch_from, unit="ms").to_pydatetime(), now,
+        )
+        split = np.searchsorted(timestamps, fetch_from, side="left")
+        # The refetched overlap must match the stored rows; anything past them is new
+        stored = timestamps.size - split
+        kept = (
+            np.array_equal(timestamps[split:], fetched_ts[:stored])
+            and np.array_equal(values[split:], fetched_values[:stored], equal_nan=True)
+        )
+        previous = manifest["file"]
+        if previous is not None and kept and timestamps.size + fetched_ts.size - stored <= manifest["capacity"]:
+            published = manifest
+            if fetched_ts.size > stored:
+                published = self._append(manifest, fetched_ts[stored:], fetched_values[stored:])
+                self.writes += 1
+            published = {**published, "synced": now_ms}
+        else:
+            # First sync, revised readings or a full file: readings past the retention are trimmed into a new file
+            keep = np.searchsorted(timestamps, horizon, side="left")
+            timestamps = np.concatenate((timestamps[keep:split], fetched_ts))
+            values = np.concatenate((values[keep:split], fetched_values)).astype(COLUMN_DTYPE, copy=False)
+            published = self._write(name, manifest["version"] + 1, timestamps, values, max(since, horizon), now_ms)
+            self.writes += 1
+        self._write_json(self._path(f"{name}.json"), published)
+        if previous is not None and previous != published["file"]:
+            # Workers that mapped the old file keep their pages until they remap
+            self._remove(previous)
+        self.refreshes += 1
+
+    def _remove(self, *names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _drop(self, name):
+        manifest = self._manifest(name)
+        self._remove(f"{name}.json", os.path.join("wanted", name), *([manifest["file"]] if manifest and manifest["file"] else []))
+        with self._lock:
+            self._maps.pop(name, None)
+
+    def refresh(self):
+        # One pass over the wanted series; runs only in the worker holding the writer lock
+        now = time.time()
+        for marker in os.scandir(self._path("wanted")):
+            if marker.name.endswith(".tmp"):
+                continue
+            if now - marker.stat().st_mtime > self.idle:
+                self._drop(marker.name)
+                continue
+            try:
+                with open(marker.path) as f:
+                    key = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if key["source"] not in self.sources:
+                continue
+            try:
+                self.refresh_series(key["source"], key["meter"], key["metric"])
+            except PyMongoError as e:
+                logging.error(f"Series store refresh of {marker.name} failed: {e}")
+
+    def _sweep(self):
+        # Data files left behind by a writer that stopped between writing and publishing
+        names = os.listdir(self.directory)
+        referenced = {(self._manifest(name[:-5]) or {}).get("file") for name in names if name.endswith(".json")}
+        self._remove(*(name for name in names if name.endswith(".bin") and name not in referenced))
+
+    def _acquire(self):
+        if self._lock_file is not None:
+            return True
+        handle = open(self._path("writer.lock"), "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        self._sweep()
+        log_event(logger, logging.INFO, "series_store_writer", pid=os.getpid(), directory=self.directory)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Workers that do not hold the lock retry, taking over if the writer exits
+            try:
+                if self._acquire():
+                    self.refresh()
+                self._evict()
+            except Exception as e:
+                logging.error(f"Series store refresh failed: {e}")
+            self._stop.wait(self.poll)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        os.makedirs(self._path("wanted"), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="series-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self):
+        with self._lock:
+            mapped = len(self._maps)
+        return {
+            "enabled": self.enabled,
+            "writer": self._lock_file is not None,
+            "mapped": mapped,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "refreshes": self.refreshes,
+            "writes": self.writes,
+        }
+
+
+series_store = SeriesStore(
+    os.getenv("SERIES_STORE_DIR") or None,
+    retention=float(os.getenv("SERIES_STORE_DAYS", "35")) * 86400,
+    poll=float(os.getenv("SERIES_STORE_POLL", "30")),
+    idle=float(os.getenv("SERIES_STORE_IDLE", "86400")),
+    max_lag=float(os.getenv("SERIES_STORE_MAX_LAG")) if os.getenv("SERIES_STORE_MAX_LAG") else None,
+)
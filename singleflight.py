@@ -0,0 +1,34 @@
+import asyncio
+
+
+class SingleFlight:
+    """Shares one in-flight computation between concurrent callers with the same key.
+
+    The first caller for a key starts the computation as a task and later
+    callers await the same task, so they all get its result or exception.
+    The task is shielded, so a caller that disconnects does not cancel the
+    work for the others. Nothing is kept once the task finishes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+# Shared by /forecast and /forecasting; keys start with the endpoint name
+forecast_flight = SingleFlight()
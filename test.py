@@ -1,15 +1,35 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime,timedelta
+import numpy as np
 import pandas as pd
-from statsmodels.tsa.stattools import adfuller
-import logging ,random 
+import logging ,random ,time
 from rdb.co import collection ,prediction_collection
-from statsmodels.tsa.statespace.sarimax import SARIMAX
+from pymongo.errors import ExecutionTimeout
+from model_cache import forecast_cache
+from engines import ENGINE_DESCRIPTION, SEASONAL_PERIODS, engine_headers, get_engine
+from forecast_pool import forecast_pool, forecast_jobs
+from prediction_store import writer_from_env
+from columnar import ColumnarResponse, Columns, epoch_ms, read_columns
+from async_db import QUERY_TIMEOUT_MS
+from resampler import StreamingResampler, stream_resample
+from precompute import ForecastSource, forecast_scheduler, forecast_store, start_from_env, stored_columns
+from singleflight import forecast_flight
+from timeseries import TIMESERIES_READS, readings_timeseries, timeseries_query
+from model_orders import tuned_engine
+from warmup import prewarm_from_env
+from series_store import series_store
+from instrumentation import TimedRoute, log_event, stage
 from demo.schemas import BaseModel ,ForecastData
-from typing import List 
+from typing import List, Optional
 
 
-TRouter = APIRouter()
+TRouter = APIRouter(route_class=TimedRoute)
+TRouter.add_event_handler("startup", prewarm_from_env)
+
+logger = logging.getLogger(__name__)
+
+prediction_writer = writer_from_env(prediction_collection)
 
 def parse_iso_datetime(iso_str: str) -> datetime:
    
@@ -19,138 +39,180 @@ def parse_iso_datetime(iso_str: str) -> datetime:
         raise ValueError(f"Invalid date format: {iso_str}. Error: {str(e)}")
 
 
-def get_data(collection, start_date: datetime, end_date: datetime, meter: int, _ID: str):
+def forecasting_query(start_date: datetime, end_date: datetime, meter: int, _ID: str):
+    # Log query parameters
+    log_event(logger, logging.DEBUG, "forecasting_query", start=start_date, end=end_date, meter=meter, object_id=_ID)
+
+    # Query the database for nested data
+    return (
+        {
+            "createdAt": {"$gte": start_date, "$lte": end_date},
+            "meter": meter,
+            f"data.{_ID}": {"$exists": True}  # Ensure the nested data object exists
+        },
+        {
+            f"data.{_ID}.value": 1,  # Include the value
+            "createdAt": 1,  # Include createdAt
+            "meter": 1  # Include meter
+        }
+    )
+
+
+def readings_query(start_date: datetime, end_date: datetime, meter: int, _ID: str):
+    # Collection, query, projection and value path for one metric's readings
+    if TIMESERIES_READS:
+        return (readings_timeseries, *timeseries_query(start_date, end_date, meter, _ID), ("value",))
+    return (collection, *forecasting_query(start_date, end_date, meter, _ID), ("data", _ID, "value"))
+
+
+# Recent per-metric windows are served from the workers' shared series store
+series_store.register("forecasting", lambda meter, metric, start_date, end_date: readings_query(start_date, end_date, meter, metric))
+series_store.start()
+
+
+def get_columns(start_date: datetime, end_date: datetime, meter: int, _ID: str):
+    stored = series_store.read("forecasting", meter, _ID, start_date, end_date)
+    if stored is not None:
+        return stored
+    source, query, projection, value_path = readings_query(start_date, end_date, meter, _ID)
     try:
-        # Log query parameters
-        print(f"Query Parameters - Start Date: {start_date}, End Date: {end_date}, Meter: {meter}, Object ID: {_ID}")
-
-        # Query the database for nested data
-        data = collection.find(
-            {
-                "createdAt": {"$gte": start_date, "$lte": end_date},
-                "meter": meter,
-                f"data.{_ID}": {"$exists": True}  # Ensure the nested data object exists
-            },
-            {
-                f"data.{_ID}.value": 1,  # Include the value
-                "createdAt": 1,  # Include createdAt
-                "meter": 1  # Include meter
-            }
-        )
-
-        fetched_data = []
-        for item in data:
-            nested_data = item['data'][_ID]
-            fetched_data.append({
-                "createdAt": item['createdAt'],
-                "meter": item['meter'],
-                "value": nested_data.get('value')
-            })
+        data = source.find(query, projection).max_time_ms(QUERY_TIMEOUT_MS)
 
-        return fetched_data
+        # Decode straight into timestamp/value arrays
+        return read_columns(data, value_path=value_path)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Database query timed out.")
     except Exception as e:
         logging.error(f"Database query failed: {e}")
         raise HTTPException(status_code=500, detail="Database query error.")
 
 
+# Resampling frequency and forecast horizon per time period
+FORECASTING_RESOLUTIONS = {"day": ("1min", 1440), "week": ("15min", 672), "month": ("1h", 720)}
 
-@TRouter.get("/forecasting", response_model=List[ForecastData])
-def forecast_data(
-    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
-    meterID: int = Query(...),
-    startDate: str = Query(...),
-    endDate: str = Query(...),
-    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'")
-):
+
+async def resample_data(start_date: datetime, end_date: datetime, meter: int, _ID: str, timePeriod: str):
+    # Aggregated batch by batch, so long windows never hold all raw readings. Missing values
+    # count as 0 and the last horizon's worth of readings is kept for the "value" field
+    freq, forecast_periods = FORECASTING_RESOLUTIONS[timePeriod]
+    resampler = StreamingResampler(start_date, end_date, freq, fill=0.0, tail=forecast_periods)
+    stored = series_store.read("forecasting", meter, _ID, start_date, end_date)
+    if stored is not None:
+        await run_in_threadpool(resampler.add, stored.timestamps, stored.values)
+        return resampler
+    source, query, projection, value_path = readings_query(start_date, end_date, meter, _ID)
+    try:
+        return await stream_resample(source, query, projection, resampler, value_path)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Database query timed out.")
+    except Exception as e:
+        logging.error(f"Database query failed: {e}")
+        raise HTTPException(status_code=500, detail="Database query error.")
+
+
+def forecasting_object_id(type: str):
+    # Map type to object_id
+    if type == "forecast-kilowatt-data":
+        return "66f0efcdf65db44ec9603972"
+    elif type == "forecast-current-data":
+        return "66f0f06ef65db44ec960398a"
+    elif type == "forecast-voltage-data":
+        return "66f0f039f65db44ec9603982"
+    raise HTTPException(status_code=400, detail="Invalid forecast type.")
+
+
+def forecasting_window(type: str, meterID: int, startDate: str, endDate: str, timePeriod: str):
+    # Parse dates
+    start = datetime.fromisoformat(startDate)
+    end = datetime.fromisoformat(endDate)
+    log_event(logger, logging.DEBUG, "forecasting_request", start=start, end=end, type=type, meter=meterID, time_period=timePeriod)
+
+    object_id = forecasting_object_id(type)
+
+    # Adjust time period
+    if timePeriod == "week":
+        start -= timedelta(days=start.weekday() + 1)
+        end = start + timedelta(days=6)
+    elif timePeriod == "month":
+        start = start.replace(day=1)
+        end = (start.replace(month=start.month % 12 + 1, day=1) - timedelta(days=1))
+    elif timePeriod != "day":
+        raise HTTPException(status_code=400, detail="Invalid time period.")
+    return object_id, start, end
+
+
+def forecast_columns(object_id: str, meterID: int, timePeriod: str, start: datetime, data, forecaster, timings: Optional[dict] = None, format: str = "json", block: bool = False):
+    # ``data`` holds timestamp/value columns, or readings already streamed into a resampler
+    if timePeriod not in FORECASTING_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Invalid time period.")
+    freq, forecast_periods = FORECASTING_RESOLUTIONS[timePeriod]
+    forecaster = tuned_engine(forecaster, "forecasting", object_id, meterID, timePeriod)
+    if isinstance(data, Columns):
+        with stage("resample"):
+            data = StreamingResampler.from_columns(data, freq, fill=0.0, tail=forecast_periods)
+
+    if not data.rows:
+        raise HTTPException(status_code=404, detail=f"No data found for object ID {object_id}")
+
+    log_event(logger, logging.DEBUG, "original_data", rows=data.rows, last=data.last_time)
+
+    if not data.valid:
+        raise HTTPException(status_code=500, detail="No valid 'value' data found.")
+
+    if data.invalid_times:
+        raise HTTPException(status_code=500, detail="Invalid 'createdAt' timestamps.")
+
+    # Forward-filled onto the period's grid; missing values were filled with 0, and so are
+    # the buckets before the first reading, which have nothing to carry (as in /forecast)
+    with stage("resample"):
+        y_resampled = data.series("asof").fillna(0.0)
+    values = data.tail_values
+
+    log_event(logger, logging.DEBUG, "resampled_data", rows=len(y_resampled), tail=y_resampled.tail())
+
+    # Reuse the fitted model, filtering in only the readings that arrived since it was cached
+    watermark = (data.last_time, data.rows)
+
+    # Forecasting with the selected engine (SARIMA by default)
+    fit_started = time.perf_counter()
     try:
-        # Parse dates
-        start = datetime.fromisoformat(startDate)
-        end = datetime.fromisoformat(endDate)
-        print(f"Parsed Dates - Start: {start}, End: {end}")
-
-        # Map type to object_id
-        if type == "forecast-kilowatt-data":
-            object_id = "66f0efcdf65db44ec9603972"
-        elif type == "forecast-current-data":
-            object_id = "66f0f06ef65db44ec960398a"
-        elif type == "forecast-voltage-data":
-            object_id = "66f0f039f65db44ec9603982"
-        else:
-            raise HTTPException(status_code=400, detail="Invalid forecast type.")
-
-        # Adjust time period
-        if timePeriod == "week":
-            start -= timedelta(days=start.weekday() + 1)
-            end = start + timedelta(days=6)
-        elif timePeriod == "month":
-            start = start.replace(day=1)
-            end = (start.replace(month=start.month % 12 + 1, day=1) - timedelta(days=1))
-        elif timePeriod != "day":
-            raise HTTPException(status_code=400, detail="Invalid time period.")
-
-        # Retrieve data from the collection
-        data = get_data(collection, start, end, meterID, object_id)
-        if not data:
-            raise HTTPException(status_code=404, detail=f"No data found for object ID {object_id}")
-
-        # Convert data to DataFrame
-        df = pd.DataFrame(data)
-        print(f"Original Data: {df.tail()}")  # Log the last few rows of original data
-
-        if 'value' not in df.columns or df['value'].isnull().all():
-            raise HTTPException(status_code=500, detail="No valid 'value' data found.")
-        
-        # Fill missing values in 'value' and handle timestamp conversion
-        df['value'] = df['value'].fillna(0)
-        df['ds'] = pd.to_datetime(df['createdAt'], errors='coerce')
-        
-        if df['ds'].isnull().any():
-            raise HTTPException(status_code=500, detail="Invalid 'createdAt' timestamps.")
-        
-        df['y'] = df['value']
-        df.set_index('ds', inplace=True)
-
-        # Resample data based on the selected time period
-        if timePeriod == 'day':
-            df_resampled = df.resample('1min').ffill()  # Resample every minute for day data
-            forecast_periods, freq = 1440, '1min'
-        elif timePeriod == 'week':
-            df_resampled = df.resample('15min').ffill()  # Resample every 15 minutes for weekly data
-            forecast_periods, freq = 672, '15min'
-        elif timePeriod == 'month':
-            df_resampled = df.resample('1h').ffill()  # Resample every hour for monthly data
-            forecast_periods, freq = 720, '1h'
-        else:
-            raise HTTPException(status_code=400, detail="Invalid time period.")
-
-        print(f"Resampled Data: {df_resampled.tail()}")  # Log the resampled data
-
-        # Forecasting with SARIMA
-        try:
-            model = SARIMAX(
-                df_resampled['y'],
-                order=(1, 1, 1),
-                seasonal_order=(1, 1, 1, 24),
-                enforce_stationarity=False,
-                enforce_invertibility=False,
+        with stage("fit"):
+            model_fit = forecast_cache.get_or_fit(
+                ("forecasting", forecaster.name, object_id, meterID, timePeriod, start),
+                watermark,
+                y_resampled,
+                lambda: forecast_pool.run(
+                    forecaster.fit,
+                    y_resampled.to_numpy(dtype=float),
+                    SEASONAL_PERIODS[freq],
+                    block=block,
+                ),
             )
-            model_fit = model.fit(disp=False)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"SARIMA model error: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"{forecaster.name} model error: {e}")
+    fit_ms = (time.perf_counter() - fit_started) * 1000
 
-        # Generate forecast values
-        forecast_index = pd.date_range(
-            start=df_resampled.index[-1] + pd.Timedelta(freq),
-            periods=forecast_periods,
-            freq=freq
-        )
+    # Generate forecast values
+    forecast_index = pd.date_range(
+        start=y_resampled.index[-1] + pd.Timedelta(freq),
+        periods=forecast_periods,
+        freq=freq
+    )
 
+    predict_started = time.perf_counter()
+    with stage("forecast"):
         forecast_values = model_fit.forecast(steps=forecast_periods)
-        print(f"Forecast Values: {forecast_values[:5]}")  # Log first few forecasted values
+    predict_ms = (time.perf_counter() - predict_started) * 1000
+    if timings is not None:
+        timings.update(engine=forecaster.name, fit_ms=fit_ms, predict_ms=predict_ms)
+    log_event(logger, logging.DEBUG, "forecast_values", head=forecast_values[:5])  # Log first few forecasted values
 
-        # Prepare forecasted data with actual and forecasted values
+    # Prepare forecasted data with actual and forecasted values
+    with stage("response"):
         forecasted_data = []
-        for date, forecast_value, actual_value in zip(forecast_index, forecast_values, df['value'].iloc[-len(forecast_values):]):
+        for date, forecast_value, actual_value in zip(forecast_index, forecast_values, values[-len(forecast_values):]):
             yhat = forecast_value  # Forecasted value
             forecasted_data.append({
                 "id": object_id,
@@ -163,16 +225,139 @@ def forecast_data(
                 }
             })
 
-        # Log forecasted data before inserting
-        print(f"Forecasted Data: {forecasted_data[:5]}")  # Log first few forecasted data points
+    # Log forecasted data before inserting
+    log_event(logger, logging.DEBUG, "forecasted_data", head=forecasted_data[:5])  # Log first few forecasted data points
+
+    # Insert predictions if they do not already exist (one bulk upsert)
+    with stage("persist"):
+        prediction_writer.write(forecasted_data)
+
+    if format == "columnar":
+        # Parallel arrays, truncated the same way as the records above
+        actual = values[-len(forecast_values):]
+        n = min(len(forecast_index), len(actual))
+        return {
+            "id": object_id,
+            "meter": meterID,
+            "timestamps": epoch_ms(forecast_index.values[:n]),
+            "values": actual[:n],
+            "yhat": np.asarray(forecast_values, dtype=float)[:n],
+        }
+    return forecasted_data
+
+
+def run_forecasting(type: str, meterID: int, startDate: str, endDate: str, timePeriod: str, engine: Optional[str] = None):
+    # Synchronous /forecasting for background jobs
+    forecaster = get_engine(engine)
+    object_id, start, end = forecasting_window(type, meterID, startDate, endDate, timePeriod)
+    data = get_columns(start, end, meterID, object_id)
+    return forecast_columns(object_id, meterID, timePeriod, start, data, forecaster)
+
+
+def active_meters(type: str, since: datetime):
+    object_id = forecasting_object_id(type)
+    if TIMESERIES_READS:
+        return readings_timeseries.distinct("meta.meter", {"meta.metric": object_id, "createdAt": {"$gte": since}})
+    return collection.distinct("meter", {"createdAt": {"$gte": since}, f"data.{object_id}": {"$exists": True}})
+
+
+def precompute_window(type: str, period: str, start: datetime, end: datetime):
+    return forecasting_window(type, None, start.isoformat(), end.isoformat(), period)
+
+
+def precompute_forecasting(type: str, meter: int, period: str, start: datetime, end: datetime):
+    # Like the endpoint, this also writes the points to the prediction collection
+    object_id, start, end = forecasting_window(type, meter, start.isoformat(), end.isoformat(), period)
+    data = get_columns(start, end, meter, object_id)
+    return forecast_columns(object_id, meter, period, start, data, get_engine(None), block=True)
+
+
+def precompute_series(type: str, meter: int, period: str, start: datetime, end: datetime):
+    object_id, start, end = forecasting_window(type, meter, start.isoformat(), end.isoformat(), period)
+    data = StreamingResampler.from_columns(get_columns(start, end, meter, object_id), FORECASTING_RESOLUTIONS[period][0], fill=0.0)
+    return data.series("asof").fillna(0.0).to_numpy(dtype=float)
+
+
+forecast_scheduler.register(ForecastSource(
+    "forecasting",
+    ("forecast-kilowatt-data", "forecast-current-data", "forecast-voltage-data"),
+    active_meters,
+    precompute_window,
+    precompute_forecasting,
+    precompute_series,
+    {period: freq for period, (freq, _) in FORECASTING_RESOLUTIONS.items()},
+))
+start_from_env()
+
+
+async def forecasting_payload(object_id: str, meterID: int, timePeriod: str, start: datetime, end: datetime, forecaster, format: str):
+    # Serve a fresh precomputed forecast when the scheduler has one
+    with stage("store"):
+        stored = await run_in_threadpool(forecast_store.load, object_id, meterID, timePeriod, start, end, forecaster.name)
+    if stored is not None:
+        if format == "columnar":
+            stored = {"id": object_id, "meter": meterID, **stored_columns(stored)}
+        return stored, {"X-Forecast-Source": "precomputed"}
+
+    # Retrieve data from the collection, resampled as it streams in
+    with stage("get_data"):
+        data = await resample_data(start, end, meterID, object_id, timePeriod)
 
-        # Insert predictions if they do not already exist
-        for forecast in forecasted_data:
-            if not prediction_collection.find_one({"meter": meterID, "data.createdAt": forecast['data']['createdAt']}):
-                prediction_collection.insert_one(forecast)
+    # Resampling, fitting and the prediction write block, so they run in a worker thread
+    timings = {}
+    forecasted_data = await run_in_threadpool(forecast_columns, object_id, meterID, timePeriod, start, data, forecaster, timings, format)
+    return forecasted_data, engine_headers(timings)
 
+
+@TRouter.get("/forecasting", response_model=List[ForecastData])
+async def forecast_data(
+    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
+    meterID: int = Query(...),
+    startDate: str = Query(...),
+    endDate: str = Query(...),
+    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
+    engine: Optional[str] = Query(None, description=ENGINE_DESCRIPTION),
+    format: str = Query("json", description="Response format: 'json' (default) or 'columnar' for parallel epoch-ms timestamp/value/yhat arrays"),
+    response: Response = None
+):
+    try:
+        if format not in ("json", "columnar"):
+            raise HTTPException(status_code=400, detail="Invalid format. Use 'json' or 'columnar'.")
+        forecaster = get_engine(engine)
+        object_id, start, end = forecasting_window(type, meterID, startDate, endDate, timePeriod)
+
+        # Identical concurrent requests share one query, fit and prediction write
+        key = ("forecasting", object_id, meterID, timePeriod, start, end, forecaster.name, format)
+        forecasted_data, headers = await forecast_flight.run(key, forecasting_payload, object_id, meterID, timePeriod, start, end, forecaster, format)
+        if format == "columnar":
+            return ColumnarResponse(forecasted_data, headers=headers)
+        if response is not None:
+            response.headers.update(headers)
         return forecasted_data
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error during forecasting: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@TRouter.post("/forecasting/jobs")
+def submit_forecasting_job(
+    type: str = Query(..., description="Forecast type, e.g., forecast-kilowatt-data, forecast-current-data, forecast-voltage-data"),
+    meterID: int = Query(...),
+    startDate: str = Query(...),
+    endDate: str = Query(...),
+    timePeriod: str = Query(..., description="Forecast period, e.g., 'day', 'week', or 'month'"),
+    engine: Optional[str] = Query(None, description=ENGINE_DESCRIPTION)
+):
+    get_engine(engine)
+    job_id = forecast_jobs.submit(
+        run_forecasting, type=type, meterID=meterID, startDate=startDate, endDate=endDate, timePeriod=timePeriod, engine=engine
+    )
+    return {"job_id": job_id, "status": "pending"}
+
+
+@TRouter.get("/forecasting/jobs/{job_id}")
+def forecasting_job_status(job_id: str):
+    return forecast_jobs.status(job_id)
\ No newline at end of file
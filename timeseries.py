@@ -0,0 +1,162 @@
+"""Copy of the readings collection as a MongoDB time-series collection.
+
+Each ``data.<objectId>`` entry of a reading becomes its own measurement
+``{"createdAt", "meta": {"meter", "metric"}, "value"}``, so a query for one
+meter and metric touches only that series' buckets instead of every nested
+reading document. Backfill and keep it in sync with:
+
+    python timeseries.py --batch-size 5000 --follow 60
+
+/forecasting reads from it when READINGS_TIMESERIES=1.
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from rdb.co import collection
+
+TIMESERIES_COLLECTION = os.getenv("READINGS_TIMESERIES_COLLECTION", "readings_timeseries")
+TIMESERIES_READS = os.getenv("READINGS_TIMESERIES", "0") == "1"
+GRANULARITY = os.getenv("READINGS_TIMESERIES_GRANULARITY", "minutes")
+
+readings_timeseries = collection.database[TIMESERIES_COLLECTION]
+migrations = collection.database["migrations"]
+
+
+def ensure_timeseries(target, granularity=GRANULARITY):
+    db = target.database
+    if target.name not in db.list_collection_names():
+        db.create_collection(
+            target.name,
+            timeseries={"timeField": "createdAt", "metaField": "meta", "granularity": granularity},
+        )
+    target.create_index(
+        [("meta.meter", ASCENDING), ("meta.metric", ASCENDING), ("createdAt", ASCENDING)],
+        name="meter_metric_createdAt",
+    )
+
+
+def flatten(document):
+    # One measurement per nested metric; sourceId lets a half-written batch be cleared
+    for metric, nested in (document.get("data") or {}).items():
+        if isinstance(nested, dict):
+            yield {
+                "createdAt": document["createdAt"],
+                "meta": {"meter": document["meter"], "metric": metric},
+                "value": nested.get("value"),
+                "sourceId": document["_id"],
+            }
+
+
+def timeseries_query(start_date: datetime, end_date: datetime, meter: int, metric: str):
+    return (
+        {"meta.meter": meter, "meta.metric": metric, "createdAt": {"$gte": start_date, "$lte": end_date}},
+        {"_id": 0, "createdAt": 1, "value": 1},
+    )
+
+
+class ReadingsMigration:
+    """Streams the readings collection into the time-series copy in ``_id`` order.
+
+    Progress is checkpointed per batch under ``name`` in ``checkpoints``, so
+    a stopped run continues after the last copied document. A batch is
+    marked pending before it is written; if the run dies mid-batch, the
+    next run deletes that batch's measurements first (deletes on
+    non-meta fields of a time-series collection need MongoDB 7.0).
+    Documents younger than ``settle`` seconds are left for a later batch,
+    so that writers whose ObjectIds lag the clock are not skipped.
+    """
+
+    def __init__(self, source, target, checkpoints, name="readings_timeseries", batch_size=5000, settle=60):
+        self.source = source
+        self.target = target
+        self.checkpoints = checkpoints
+        self.name = name
+        self.batch_size = batch_size
+        self.settle = settle
+
+    def state(self):
+        return self.checkpoints.find_one({"_id": self.name}) or {}
+
+    def _clear(self, pending):
+        source_id = {"$lte": pending["through"]}
+        if pending.get("after") is not None:
+            source_id["$gt"] = pending["after"]
+        deleted = self.target.delete_many({"sourceId": source_id}).deleted_count
+        logging.warning(f"Cleared {deleted} measurements of an unfinished migration batch")
+
+    def run_batch(self):
+        state = self.state()
+        if state.get("pending"):
+            self._clear(state["pending"])
+        last_id = state.get("lastId")
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.settle))
+        query = {"_id": {"$lt": cutoff}}
+        if last_id is not None:
+            query["_id"]["$gt"] = last_id
+        documents = list(self.source.find(query).sort("_id", ASCENDING).limit(self.batch_size))
+        if not documents:
+            return 0
+
+        through = documents[-1]["_id"]
+        self.checkpoints.update_one(
+            {"_id": self.name}, {"$set": {"pending": {"after": last_id, "through": through}}}, upsert=True
+        )
+        measurements = [measurement for document in documents for measurement in flatten(document)]
+        if measurements:
+            self.target.insert_many(measurements, ordered=False)
+        self.checkpoints.update_one(
+            {"_id": self.name},
+            {
+                "$set": {"lastId": through, "pending": None, "updatedAt": datetime.now(timezone.utc)},
+                "$inc": {"documents": len(documents), "measurements": len(measurements)},
+            },
+        )
+        return len(documents)
+
+    def run(self, follow=None, max_batches=None):
+        ensure_timeseries(self.target)
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            try:
+                copied = self.run_batch()
+            except PyMongoError as e:
+                # The checkpoint still points at the last finished batch
+                logging.error(f"Migration batch failed: {e}")
+                if follow is None:
+                    raise
+                time.sleep(follow)
+                continue
+            batches += 1
+            if copied:
+                state = self.state()
+                logging.info(f"Migrated {state.get('documents', 0)} documents, {state.get('measurements', 0)} measurements")
+            elif follow is None:
+                break
+            else:
+                time.sleep(follow)
+        return self.state()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--settle", type=float, default=60, help="Seconds a reading must be old before it is copied")
+    parser.add_argument("--follow", type=float, default=None, help="Keep polling for new readings every this many seconds")
+    parser.add_argument("--max-batches", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migration = ReadingsMigration(collection, readings_timeseries, migrations, batch_size=args.batch_size, settle=args.settle)
+    state = migration.run(follow=args.follow, max_batches=args.max_batches)
+    print(f"{state.get('documents', 0)} documents, {state.get('measurements', 0)} measurements migrated")
+
+
+if __name__ == "__main__":
+    main()
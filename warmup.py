@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from columnar import dumps, epoch_ms
+from forecast_pool import forecast_pool
+from instrumentation import log_event
+from resampler import StreamingResampler
+
+logger = logging.getLogger(__name__)
+
+# FORECAST_PREWARM=1 loads the modeling stack at startup instead of on the first forecast
+PREWARM = os.getenv("FORECAST_PREWARM", "0") == "1"
+
+_done = False
+_lock = threading.Lock()
+
+
+def tiny_fit():
+    # Imports statsmodels and fits a minimal model in whichever process runs it
+    from model_cache import fit_sarimax
+
+    started = time.perf_counter()
+    values = 10 + np.sin(np.arange(96) * 2 * np.pi / 24)
+    fit_sarimax(values, (1, 1, 1), (0, 0, 0, 0)).forecast(steps=4)
+    return os.getpid(), time.perf_counter() - started
+
+
+def warm_worker():
+    # Pool initializer; an exception here would break the pool, so a failed warm-up is only logged
+    try:
+        tiny_fit()
+    except Exception as e:
+        logging.error(f"Forecast worker warm-up failed: {e}")
+
+
+def warm_data_path():
+    # First calls into pandas resampling and the response encoders are slower than later ones
+    timestamps = np.arange("2024-01-01T00:00", "2024-01-01T02:00", dtype="datetime64[m]").astype("datetime64[ms]")
+    resampler = StreamingResampler(timestamps[0], timestamps[-1], "15min")
+    resampler.add(timestamps, np.arange(timestamps.size, dtype=float))
+    series = resampler.series("asof")
+    dumps({"timestamps": epoch_ms(series.index.values), "values": series.to_numpy()})
+
+
+def prewarm(pool=forecast_pool):
+    """Loads the forecasting stack in this process and in every pool worker.
+
+    Blocks until done. Runs once per process; later calls return immediately.
+    """
+    global _done
+    with _lock:
+        if _done:
+            return
+        started = time.perf_counter()
+        warm_data_path()
+        # Fitted models are unpickled and forecast here, so this process needs the stack as well
+        workers = {tiny_fit()[0]}
+        # Each worker warms up in its initializer, before taking its first fit
+        workers.update(pool.start(initializer=warm_worker))
+        _done = True
+    log_event(logger, logging.INFO, "prewarm", seconds=f"{time.perf_counter() - started:.2f}", processes=len(workers))
+
+
+async def prewarm_from_env():
+    # Startup hook; the fits block, so they run in a worker thread
+    if PREWARM:
+        await run_in_threadpool(prewarm, forecast_pool)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Prewarm for apps created with ``FastAPI(lifespan=...)``.
+
+    Such apps never run the routers' startup handlers, so they pass this
+    lifespan (or call ``prewarm_from_env`` from their own) instead.
+    """
+    await prewarm_from_env()
+    yield